@@ -1,5 +1,6 @@
 #!/bin/sh
 python ./manage.py migrate
+python ./manage.py collectstatic --noinput
 
 if [ -f "./data/polls-v4.json" ]; then
   python ./manage.py loaddata ./data/polls-v4.json
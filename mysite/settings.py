@@ -44,23 +44,68 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'polls.middleware.StaticFilesMiddleware',
+    'polls.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'polls.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'polls.routers.ReplicaRoutingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# gzip responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes
+RESPONSE_COMPRESSION = config("RESPONSE_COMPRESSION", default=True, cast=bool)
+RESPONSE_COMPRESSION_MIN_SIZE = config(
+    "RESPONSE_COMPRESSION_MIN_SIZE", default=1024, cast=int)
+
+# seconds the list of questions on the index page is cached; it is also
+# refreshed when a question is saved and by the run_lifecycle command
+POLLS_INDEX_CACHE_TIMEOUT = config(
+    "POLLS_INDEX_CACHE_TIMEOUT", default=60, cast=int)
+
+# send the index page header before the poll list is queried
+POLLS_STREAMING_INDEX = config(
+    "POLLS_STREAMING_INDEX", default=False, cast=bool)
+
+# Profiling of staff requests (see polls/profiling.py). A request is
+# profiled when it has an "X-Polls-Profile" header, or at random with
+# probability POLLS_PROFILING_SAMPLE_RATE. POLLS_PROFILING_MODE is
+# "cprofile" (every call) or "sample" (stack samples, lower overhead).
+POLLS_PROFILING = config("POLLS_PROFILING", default=False, cast=bool)
+POLLS_PROFILING_SAMPLE_RATE = config(
+    "POLLS_PROFILING_SAMPLE_RATE", default=0.0, cast=float)
+POLLS_PROFILING_MODE = config("POLLS_PROFILING_MODE", default="cprofile")
+POLLS_PROFILING_DIR = config(
+    "POLLS_PROFILING_DIR", default=str(BASE_DIR / "profiles"))
+
+# Prometheus metrics at /metrics (see polls/metrics.py). With several
+# server processes, POLLS_METRICS_DIR must be a directory they share.
+POLLS_METRICS = config("POLLS_METRICS", default=True, cast=bool)
+# scrapers must send "Authorization: Bearer <token>"; /metrics answers
+# 404 while no token is set
+POLLS_METRICS_TOKEN = config("POLLS_METRICS_TOKEN", default="")
+POLLS_METRICS_DIR = config("POLLS_METRICS_DIR", default="")
+POLLS_METRICS_FLUSH_INTERVAL = config(
+    "POLLS_METRICS_FLUSH_INTERVAL", default=5, cast=int)
+
 ROOT_URLCONF = 'mysite.urls'
 
+# TEMPLATE_MODE is "development" (Django's default loaders) or
+# "production" (an explicit cached loader without app directory
+# discovery, with every polls template compiled at startup).
+TEMPLATE_MODE = config("TEMPLATE_MODE", default="development")
+
 TEMPLATES = [
     {
 
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
+        'APP_DIRS': TEMPLATE_MODE != "production",
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -72,6 +117,14 @@ TEMPLATES = [
     },
 ]
 
+if TEMPLATE_MODE == "production":
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 # Database
@@ -95,6 +148,32 @@ DATABASES = {
         "PORT": config("DATABASE_PORT", default="5432")
     }
 }
+# Optional read replica (see polls/routers.py). Set DATABASE_REPLICA_HOST
+# to add a "replica" database used for browsing polls and results; the
+# other connection settings default to the primary's. For local testing
+# point it at the primary server itself.
+DATABASE_REPLICA_HOST = config("DATABASE_REPLICA_HOST", default="")
+if DATABASE_REPLICA_HOST:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": config("DATABASE_REPLICA_NAME",
+                       default=DATABASES["default"]["NAME"]),
+        "USER": config("DATABASE_REPLICA_USER",
+                       default=DATABASES["default"]["USER"]),
+        "PASSWORD": config("DATABASE_REPLICA_PASSWORD",
+                           default=DATABASES["default"]["PASSWORD"]),
+        "HOST": DATABASE_REPLICA_HOST,
+        "PORT": config("DATABASE_REPLICA_PORT",
+                       default=DATABASES["default"]["PORT"]),
+        # tests use the primary's test database for the replica
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICA_ALIAS = "replica"
+DATABASE_ROUTERS = ["polls.routers.PrimaryReplicaRouter"]
+# seconds a user's reads stay on the primary after they vote
+REPLICA_STICKY_SECONDS = config(
+    "REPLICA_STICKY_SECONDS", default=10, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -125,15 +204,64 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing policy (see polls/hashers.py). New passwords are hashed
+# with PASSWORD_HASHER: "pbkdf2" (default), "scrypt" or "argon2" (needs
+# the argon2-cffi package). Hashes made by the other hashers still verify
+# and are rehashed with the preferred one on the next successful login.
+_PASSWORD_HASHER_CLASSES = {
+    "pbkdf2": "polls.hashers.TunedPBKDF2PasswordHasher",
+    "scrypt": "polls.hashers.TunedScryptPasswordHasher",
+    "argon2": "polls.hashers.TunedArgon2PasswordHasher",
+}
+PASSWORD_HASHER = config("PASSWORD_HASHER", default="pbkdf2")
+PASSWORD_HASHERS = [_PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHER_CLASSES.items()
+    if name != PASSWORD_HASHER
+] + ["django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"]
+# cost parameters, 0 keeps Django's default; changing one rehashes
+# passwords on their next login
+PASSWORD_PBKDF2_ITERATIONS = config(
+    "PASSWORD_PBKDF2_ITERATIONS", default=0, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config(
+    "PASSWORD_SCRYPT_WORK_FACTOR", default=0, cast=int)
+PASSWORD_SCRYPT_BLOCK_SIZE = config(
+    "PASSWORD_SCRYPT_BLOCK_SIZE", default=0, cast=int)
+PASSWORD_SCRYPT_PARALLELISM = config(
+    "PASSWORD_SCRYPT_PARALLELISM", default=0, cast=int)
+PASSWORD_ARGON2_TIME_COST = config(
+    "PASSWORD_ARGON2_TIME_COST", default=0, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config(
+    "PASSWORD_ARGON2_MEMORY_COST", default=0, cast=int)
+PASSWORD_ARGON2_PARALLELISM = config(
+    "PASSWORD_ARGON2_PARALLELISM", default=0, cast=int)
+
 AUTHENTICATION_BACKENDS = [
-    # username & password authentication
-    'django.contrib.auth.backends.ModelBackend',
+    # username & password authentication, refusing rate-limited logins
+    # (also those made through the admin site)
+    'polls.backends.RateLimitedModelBackend',
 ]
 
 # redirect visitor after login or logout
 LOGIN_REDIRECT_URL = 'polls:index'  # after login, show list of polls
 LOGOUT_REDIRECT_URL = 'login'  # after logout, return to login page
 
+# failed-login rate limiting (see polls/ratelimit.py): at most
+# LOGIN_RATE_LIMIT_IP failures per IP and LOGIN_RATE_LIMIT_USER failures
+# per username within LOGIN_RATE_WINDOW seconds
+LOGIN_RATE_LIMIT_ENABLED = config(
+    "LOGIN_RATE_LIMIT_ENABLED", default=True, cast=bool)
+LOGIN_RATE_LIMIT_IP = config("LOGIN_RATE_LIMIT_IP", default=20, cast=int)
+LOGIN_RATE_LIMIT_USER = config("LOGIN_RATE_LIMIT_USER", default=5, cast=int)
+LOGIN_RATE_WINDOW = config("LOGIN_RATE_WINDOW", default=300, cast=int)
+
+# vote throttling: at most VOTE_RATE_LIMIT votes per user and question
+# within VOTE_RATE_WINDOW seconds; an identical vote resubmitted within
+# VOTE_IDEMPOTENCY_WINDOW seconds is answered from the cache
+VOTE_RATE_LIMIT = config("VOTE_RATE_LIMIT", default=10, cast=int)
+VOTE_RATE_WINDOW = config("VOTE_RATE_WINDOW", default=60, cast=int)
+VOTE_IDEMPOTENCY_WINDOW = config(
+    "VOTE_IDEMPOTENCY_WINDOW", default=5, cast=int)
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -150,13 +278,91 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# collectstatic copies assets here
+STATIC_ROOT = BASE_DIR / config("STATIC_ROOT", default="staticfiles")
+
+# STATIC_MANIFEST stores collected assets under content-hashed names with
+# gzip/brotli copies (see polls/storage.py); run collectstatic after
+# enabling it. STATIC_SERVE serves STATIC_ROOT from the app server with
+# long-lived cache headers (see polls/middleware.py).
+STATIC_MANIFEST = config("STATIC_MANIFEST", default=False, cast=bool)
+STATIC_SERVE = config("STATIC_SERVE", default=STATIC_MANIFEST, cast=bool)
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": (
+            "polls.storage.CompressedManifestStaticFilesStorage"
+            if STATIC_MANIFEST
+            else "django.contrib.staticfiles.storage.StaticFilesStorage"
+        ),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# Cache used by sessions (in "cache" and "cached_db" modes) and by the
+# polls app. Use a shared cache such as Redis or Memcached when running
+# more than one server process.
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default=""),
+    }
+}
+
+# Session storage: "db" (default), "cached_db", "cache" or
+# "signed_cookies". Every mode except "db" avoids a django_session read
+# on each request; "cache" and "signed_cookies" never write to it.
+SESSION_STORAGE = config("SESSION_STORAGE", default="db")
+SESSION_ENGINE = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}[SESSION_STORAGE]
+
+# Message storage: "session" (default) or "cookie". Cookie messages do not
+# modify the session, so showing a message costs no session write.
+MESSAGE_STORAGE = {
+    "session": "django.contrib.messages.storage.session.SessionStorage",
+    "cookie": "django.contrib.messages.storage.cookie.CookieStorage",
+}[config("MESSAGE_STORAGE", default="session")]
+
+# number of reverse proxies in front of the site that append the client
+# address to X-Forwarded-For; rate limits trust only those addresses
+TRUSTED_PROXY_COUNT = config("TRUSTED_PROXY_COUNT", default=0, cast=int)
+# at most GUEST_VOTE_RATE_LIMIT_IP guest votes per IP and question within
+# VOTE_RATE_WINDOW seconds, whatever device they claim to come from
+GUEST_VOTE_RATE_LIMIT_IP = config(
+    "GUEST_VOTE_RATE_LIMIT_IP", default=30, cast=int)
+
+# Directory for the log file and the JSON Lines event file, kept out of
+# the source tree.
+LOG_DIR = config("LOG_DIR", default=str(BASE_DIR / "logs"))
+Path(LOG_DIR).mkdir(parents=True, exist_ok=True)
+
+# Structured vote and login events (see polls/events.py).
+# POLLS_EVENT_SINK is one of "jsonl", "db" or "none".
+POLLS_EVENT_SINK = config("POLLS_EVENT_SINK", default="jsonl")
+POLLS_EVENT_FILE = config(
+    "POLLS_EVENT_FILE", default=str(Path(LOG_DIR) / "events.jsonl"))
+# maximum events kept in memory, and how many are written per batch
+POLLS_EVENT_BUFFER_SIZE = config(
+    "POLLS_EVENT_BUFFER_SIZE", default=10000, cast=int)
+POLLS_EVENT_BATCH_SIZE = config(
+    "POLLS_EVENT_BATCH_SIZE", default=100, cast=int)
+# seconds between writes of the buffered events by a background thread;
+# 0 makes the request that fills a batch write it
+POLLS_EVENT_FLUSH_INTERVAL = config(
+    "POLLS_EVENT_FLUSH_INTERVAL", default=5, cast=float)
 
 LOGGING = {
     'version': 1,
@@ -175,7 +381,7 @@ LOGGING = {
         'file': {
             'level': 'DEBUG',
             'class': 'logging.FileHandler',
-            'filename': 'polls.log',
+            'filename': str(Path(LOG_DIR) / 'polls.log'),
             'formatter': 'verbose',
         },
         'console': {
@@ -0,0 +1,47 @@
+"""Settings for running the test suite without external services.
+
+Usage::
+
+    python manage.py test --settings=mysite.test_settings --parallel
+
+The database is an in-memory SQLite database (one per test process),
+passwords use the fast MD5 hasher, and nothing is written to the event
+file or the log file.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import LOGGING
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+}
+
+# hashing a password with the production hashers takes most of a test
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "polls-tests",
+    }
+}
+
+SESSION_ENGINE = "django.contrib.sessions.backends.db"
+TEMPLATE_MODE = "development"
+POLLS_EVENT_SINK = "none"
+# write event batches inline, so tests see them without waiting
+POLLS_EVENT_FLUSH_INTERVAL = 0
+POLLS_PROFILING = False
+POLLS_METRICS_DIR = ""
+
+# keep the logger levels, but drop the file and console output
+LOGGING = {
+    **LOGGING,
+    "handlers": {"null": {"class": "logging.NullHandler"}},
+    "loggers": {
+        name: {**logger, "handlers": ["null"]}
+        for name, logger in LOGGING["loggers"].items()
+    },
+}
@@ -17,11 +17,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
+from polls.metrics import metrics_view
+from polls.views import LoginView
 
 urlpatterns = [
     path("polls/", include("polls.urls")),
     path('admin/', admin.site.urls),
+    # rate-limited login, must come before the auth urls
+    path('accounts/login/', LoginView.as_view(), name='login'),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics', metrics_view, name='metrics'),
     # redirect base to index
     path("", RedirectView.as_view(url="polls/")),
 ]
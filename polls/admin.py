@@ -1,6 +1,20 @@
 """This file is used to register the models with the admin site."""
-from django.contrib import admin
-from .models import Choice, Question, Vote
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from . import importer
+from .models import Choice, GuestVote, Question, Vote
+
+
+class ImportPollsForm(forms.Form):
+    """Upload form for the bulk poll import."""
+
+    file = forms.FileField(help_text="A .csv or .json file of polls.")
+    dry_run = forms.BooleanField(
+        required=False, help_text="Only check the file, import nothing.")
 
 
 class ChoiceInline(admin.TabularInline):
@@ -14,17 +28,62 @@ class QuestionAdmin(admin.ModelAdmin):
     """Class to customize the admin interface for the Question model."""
 
     fieldsets = [
-        (None, {"fields": ["question_text"]}),
+        (None, {"fields": ["question_text", "allow_guests"]}),
         ("Date information",
          {"fields": ["pub_date", "end_date"], "classes": ["collapse"]}),
     ]
     inlines = [ChoiceInline]
     list_display = ["question_text", "pub_date", "end_date",
-                    "was_published_recently"]
+                    "was_published_recently", "allow_guests"]
     list_filter = ["pub_date"]
     search_fields = ["question_text"]
+    change_list_template = "admin/polls/question/change_list.html"
+
+    def get_urls(self):
+        """Add the bulk import page to the question admin urls."""
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view),
+                 name="polls_question_import"),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Validate an uploaded file and bulk-create its polls."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        errors = []
+        form = ImportPollsForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            file_format = importer.guess_format(upload.name)
+            try:
+                if file_format is None:
+                    raise ValidationError("Upload a .csv or .json file.")
+                report = importer.import_polls(
+                    upload.read().decode("utf-8-sig"), file_format,
+                    dry_run=form.cleaned_data["dry_run"])
+            except (ValidationError, UnicodeDecodeError) as error:
+                errors = getattr(error, "messages", [str(error)])
+            else:
+                verb = "would be" if form.cleaned_data["dry_run"] \
+                    else "were"
+                messages.success(
+                    request,
+                    f"{report['questions']} questions and "
+                    f"{report['choices']} choices {verb} imported in "
+                    f"{report['seconds']:.2f} s.")
+                return redirect("admin:polls_question_changelist")
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Import polls",
+            "opts": self.model._meta,
+            "form": form,
+            "errors": errors,
+        }
+        return TemplateResponse(
+            request, "admin/polls/question/import.html", context)
 
 
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(Choice)
 admin.site.register(Vote)
+admin.site.register(GuestVote)
@@ -1,6 +1,7 @@
 """Apps configuration for the `polls` application."""
 
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PollsConfig(AppConfig):
@@ -8,3 +9,10 @@ class PollsConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        """Connect signal receivers and warm the template cache."""
+        from . import lifecycle, results  # noqa: F401 (connect receivers)
+        if getattr(settings, "TEMPLATE_MODE", "") == "production":
+            from .templating import warm_templates
+            warm_templates()
@@ -0,0 +1,30 @@
+"""Authentication backends for the polls app."""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from . import ratelimit
+
+
+class RateLimitedModelBackend(ModelBackend):
+    """Username and password backend that enforces the login rate limit.
+
+    Every login goes through `authenticate()`, whether it comes from the
+    polls login page, the admin login page or any other form, so checking
+    here blocks them all. A blocked attempt is refused before the password
+    is hashed.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        """Authenticate the user unless the IP or username is blocked.
+
+        Raises:
+            PermissionDenied: If too many logins failed recently, which
+                              stops Django from trying the other backends.
+        """
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        ip = ratelimit.client_ip(request) if request is not None else None
+        if ratelimit.login_blocked(ip, username):
+            raise PermissionDenied
+        return super().authenticate(request, username, password, **kwargs)
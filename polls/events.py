@@ -0,0 +1,277 @@
+"""Structured event stream for votes and authentication.
+
+Events are kept in a bounded in-memory ring buffer and written to a sink
+in batches by a background thread, every `POLLS_EVENT_FLUSH_INTERVAL`
+seconds or as soon as a batch is full, so recording an event on the
+request path never touches the disk or the database. Readers of the sink
+such as `event_stats` do not see the events still buffered in the server
+processes, which can lag by up to that interval. With an interval of 0,
+the request that fills a batch writes it itself.
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+VOTE_CAST = "vote_cast"
+VOTE_CHANGED = "vote_changed"
+LOGIN = "login"
+LOGOUT = "logout"
+LOGIN_FAILED = "login_failed"
+
+logger = logging.getLogger('polls')
+
+EVENT_TYPES = (VOTE_CAST, VOTE_CHANGED, LOGIN, LOGOUT, LOGIN_FAILED)
+
+
+class JsonlSink:
+    """Append events to a JSON Lines file, one object per line."""
+
+    def __init__(self, path):
+        """Initialize the sink with the path of the file to append to."""
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, events):
+        """Append a batch of events to the file."""
+        lines = "".join(json.dumps(event) + "\n" for event in events)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(lines)
+
+    def read(self):
+        """Yield every event stored in the file."""
+        try:
+            file = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class DatabaseSink:
+    """Insert events into the `PollEvent` table with one query per batch."""
+
+    def write(self, events):
+        """Insert a batch of events."""
+        from .models import PollEvent
+
+        PollEvent.objects.bulk_create(
+            [PollEvent.from_event(event) for event in events]
+        )
+
+    def read(self):
+        """Yield every event stored in the table."""
+        from .models import PollEvent
+
+        for row in PollEvent.objects.order_by("timestamp").iterator():
+            yield row.to_event()
+
+
+class NullSink:
+    """Discard every event."""
+
+    def write(self, events):
+        """Do nothing with the batch."""
+
+    def read(self):
+        """Return no events."""
+        return iter(())
+
+
+class EventFlusher(threading.Thread):
+    """Flush an event buffer periodically and whenever a batch is full."""
+
+    def __init__(self, buffer, interval):
+        """Initialize a flusher of `buffer` every `interval` seconds."""
+        super().__init__(daemon=True, name="polls-event-flusher")
+        self.buffer = buffer
+        self.interval = interval
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Flush until stopped."""
+        while not self.stopped.is_set():
+            self.ready.wait(self.interval)
+            self.ready.clear()
+            self.buffer.flush()
+            # no request ends in this thread to close its connection
+            close_old_connections()
+
+    def stop(self):
+        """Stop flushing and wait for the thread to finish."""
+        self.stopped.set()
+        self.ready.set()
+        self.join()
+
+
+class EventBuffer:
+    """Bounded ring buffer that flushes events to a sink in batches.
+
+    When the buffer is full the oldest event is overwritten and counted
+    in `dropped`, so memory use never grows past `capacity` events. With
+    a `flush_interval`, batches are written by an `EventFlusher` thread,
+    started with the first event; without one, by the caller of
+    `record()` that fills a batch.
+    """
+
+    def __init__(self, sink, capacity=10000, batch_size=100,
+                 flush_interval=None):
+        """Initialize the buffer for the given sink."""
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flusher = None
+        self.events = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def record(self, event_type, **fields):
+        """Add an event to the buffer, flushing when a batch is ready.
+
+        Args:
+            event_type (str): One of `EVENT_TYPES`.
+            **fields: Extra event attributes such as `username`,
+                      `question_id`, `choice_id` or `ip`.
+        """
+        event = {"type": event_type, "timestamp": timezone.now().isoformat()}
+        event.update(fields)
+        batch = None
+        with self.lock:
+            if len(self.events) == self.capacity:
+                self.dropped += 1
+            self.events.append(event)
+            if self.flush_interval and self.flusher is None:
+                self.flusher = EventFlusher(self, self.flush_interval)
+                self.flusher.start()
+            flusher = self.flusher
+            full = len(self.events) >= self.batch_size
+            if full and flusher is None:
+                batch = self._drain()
+        if full and flusher is not None:
+            flusher.ready.set()
+        if batch:
+            self._emit(batch)
+
+    def flush(self):
+        """Write every buffered event to the sink."""
+        with self.lock:
+            batch = self._drain()
+        if batch:
+            self._emit(batch)
+
+    def close(self):
+        """Stop the flusher thread, if any, and write the pending events."""
+        if self.flusher is not None:
+            self.flusher.stop()
+            self.flusher = None
+        self.flush()
+
+    def _emit(self, batch):
+        """Write a batch to the sink, logging instead of raising on failure.
+
+        Events are recorded after the vote or login they describe has
+        been saved, so a failing sink must not fail that request.
+        """
+        try:
+            self.sink.write(batch)
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception(f"Could not write {len(batch)} events.")
+
+    def _drain(self):
+        """Remove and return all buffered events. Caller holds the lock."""
+        batch = list(self.events)
+        self.events.clear()
+        return batch
+
+
+def get_sink():
+    """Return the sink selected by the `POLLS_EVENT_SINK` setting."""
+    name = getattr(settings, "POLLS_EVENT_SINK", "jsonl")
+    if name == "jsonl":
+        return JsonlSink(
+            getattr(settings, "POLLS_EVENT_FILE",
+                    os.path.join(settings.BASE_DIR, "logs", "events.jsonl"))
+        )
+    if name == "db":
+        return DatabaseSink()
+    return NullSink()
+
+
+_buffer = None
+
+
+def get_buffer():
+    """Return the process-wide event buffer, creating it on first use."""
+    global _buffer
+    if _buffer is None:
+        _buffer = EventBuffer(
+            get_sink(),
+            capacity=getattr(settings, "POLLS_EVENT_BUFFER_SIZE", 10000),
+            batch_size=getattr(settings, "POLLS_EVENT_BATCH_SIZE", 100),
+            flush_interval=getattr(settings, "POLLS_EVENT_FLUSH_INTERVAL", 5),
+        )
+    return _buffer
+
+
+def record(event_type, **fields):
+    """Record an event in the process-wide buffer."""
+    get_buffer().record(event_type, **fields)
+
+
+def flush():
+    """Flush the process-wide buffer if it has been created."""
+    if _buffer is not None:
+        _buffer.flush()
+
+
+atexit.register(flush)
+
+
+@receiver(setting_changed)
+def reset_buffer(setting, **kwargs):
+    """Rebuild the buffer when event settings change (used by tests)."""
+    global _buffer
+    if setting.startswith("POLLS_EVENT_"):
+        if _buffer is not None:
+            _buffer.close()
+        _buffer = None
+
+
+def aggregate_by_minute(events, event_types=None, since=None):
+    """Count events per minute and per event type.
+
+    Args:
+        events (iterable): Event dictionaries as produced by a sink.
+        event_types (iterable): Only count these types, or all if None.
+        since (datetime): Ignore events older than this, or none if None.
+
+    Returns:
+        dict: Maps each minute (ISO string truncated to minutes) to a
+              `Counter` of event types, ordered by minute.
+    """
+    since = since.isoformat() if since else None
+    buckets = collections.defaultdict(collections.Counter)
+    for event in events:
+        if event_types and event["type"] not in event_types:
+            continue
+        if since and event["timestamp"] < since:
+            continue
+        buckets[event["timestamp"][:16]][event["type"]] += 1
+    return dict(sorted(buckets.items()))
@@ -0,0 +1,95 @@
+"""Voting without an account on questions that allow guests.
+
+A guest is identified by a random device token kept in a signed cookie,
+issued when the guest opens the poll.
+Only a 64-bit hash of the token is stored, in `GuestVote`, whose unique
+constraint allows one vote per device and question; it is the authority
+on duplicates.
+
+A vote is inserted without first looking for an earlier one, so the
+first vote of a device, by far the most common, costs one indexed
+insert however many guests voted. Only a device that voted before hits
+the constraint and has its vote looked up and changed. No per-process
+state is kept, so every server process sees the same votes.
+"""
+import datetime
+import hashlib
+import secrets
+
+from django.db import IntegrityError, transaction
+
+from . import results
+from .models import GuestVote
+
+DEVICE_COOKIE = "polls_device"
+DEVICE_SALT = "polls.device"
+DEVICE_MAX_AGE = int(datetime.timedelta(days=365).total_seconds())
+
+
+def get_device_token(request):
+    """Return the device token of the request, or None if it has none.
+
+    A cookie whose signature does not match counts as no token.
+    """
+    return request.get_signed_cookie(DEVICE_COOKIE, default=None,
+                                     salt=DEVICE_SALT)
+
+
+def new_device_token():
+    """Return a new random device token."""
+    return secrets.token_urlsafe(16)
+
+
+def set_device_token(response, token):
+    """Store the device token in a signed cookie on `response`."""
+    response.set_signed_cookie(DEVICE_COOKIE, token, salt=DEVICE_SALT,
+                               max_age=DEVICE_MAX_AGE, httponly=True,
+                               samesite="Lax")
+    return response
+
+
+def token_hash(token):
+    """Return the signed 64-bit hash of a device token."""
+    digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def record_guest_vote(question, choice, key):
+    """Record or change the vote of a guest device.
+
+    Args:
+        question (Question): The question voted on.
+        choice (Choice): The choice voted for.
+        key (int): The device's `token_hash()`.
+
+    Returns:
+        int: The choice the device voted for before, or None if this is
+             its first vote on the question.
+    """
+    previous_choice_id = None
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                GuestVote.objects.create(question=question, choice=choice,
+                                         token_hash=key)
+        except IntegrityError:
+            # the device voted before; locked so that concurrent votes of
+            # the device apply in turn
+            previous = GuestVote.objects.select_for_update().get(
+                question=question, token_hash=key)
+            previous_choice_id = previous.choice_id
+            previous.choice = choice
+            previous.save(update_fields=["choice"])
+        results.record_vote(question, choice, previous_choice_id)
+    return previous_choice_id
+
+
+def guest_choice(request, question):
+    """Return the choice this device voted for, or None."""
+    token = get_device_token(request)
+    if not question.allow_guests or token is None:
+        return None
+    vote = GuestVote.objects.filter(
+        question=question, token_hash=token_hash(token)) \
+        .select_related("choice").first()
+    return vote.choice if vote else None
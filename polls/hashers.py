@@ -0,0 +1,81 @@
+"""Password hashers whose cost parameters come from settings.
+
+Each hasher keeps the algorithm name of the Django hasher it extends, so
+existing hashes keep verifying. When the cost in settings changes,
+`must_update()` reports stored hashes as outdated and Django rehashes the
+password transparently on the user's next successful login. A setting of
+0 (or no setting) keeps Django's default for that parameter.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+
+
+def _setting(name, default):
+    """Return the setting `name`, or `default` if it is unset or 0."""
+    return getattr(settings, name, 0) or default
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with `PASSWORD_PBKDF2_ITERATIONS` iterations."""
+
+    @property
+    def iterations(self):
+        """Return the configured iteration count."""
+        return _setting("PASSWORD_PBKDF2_ITERATIONS",
+                        PBKDF2PasswordHasher.iterations)
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with the cost set by `PASSWORD_SCRYPT_*` settings."""
+
+    @property
+    def work_factor(self):
+        """Return N, the CPU/memory cost (a power of two)."""
+        return _setting("PASSWORD_SCRYPT_WORK_FACTOR",
+                        ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        """Return r, the block size."""
+        return _setting("PASSWORD_SCRYPT_BLOCK_SIZE",
+                        ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        """Return p, the parallelization factor."""
+        return _setting("PASSWORD_SCRYPT_PARALLELISM",
+                        ScryptPasswordHasher.parallelism)
+
+    @property
+    def maxmem(self):
+        """Return a memory limit large enough for the configured cost."""
+        return 2 * 128 * self.work_factor * self.block_size
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id with the cost set by `PASSWORD_ARGON2_*` settings.
+
+    Requires the optional `argon2-cffi` package.
+    """
+
+    @property
+    def time_cost(self):
+        """Return the number of passes over memory."""
+        return _setting("PASSWORD_ARGON2_TIME_COST",
+                        Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        """Return the memory used per hash, in KiB."""
+        return _setting("PASSWORD_ARGON2_MEMORY_COST",
+                        Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        """Return the number of lanes."""
+        return _setting("PASSWORD_ARGON2_PARALLELISM",
+                        Argon2PasswordHasher.parallelism)
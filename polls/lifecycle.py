@@ -0,0 +1,176 @@
+"""Publish/close transitions of polls and the cached index.
+
+`LifecycleScheduler` keeps the upcoming publish and close instants of all
+questions in a priority queue. When one passes, it invalidates and warms
+the cached index, and when a poll closes it freezes the poll's final
+results, so a closed poll never needs its votes counted again. The
+`run_lifecycle` management command drives the scheduler.
+
+The scheduler runs in its own process, so its invalidations only reach
+the web server through a cache shared by all processes (Redis,
+Memcached, the database or file cache). `LocMemCache` is private to each
+process: `run_lifecycle` refuses to start with it, and `check --deploy`
+warns about it.
+"""
+import heapq
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+from .models import Question
+from .results import freeze_results
+
+logger = logging.getLogger('polls')
+
+PUBLISH = "publish"
+CLOSE = "close"
+
+INDEX_CACHE_KEY = "polls:index:ids"
+
+
+def _index_ids(now):
+    """Query the ids of the questions shown on the index page."""
+    return list(Question.objects.filter(pub_date__lte=now)
+                .order_by("-pub_date").values_list("id", flat=True)[:5])
+
+
+def index_question_ids():
+    """Return the ids of the questions on the index, using the cache.
+
+    The cached list expires no later than the next publish instant, so a
+    newly published poll shows up on time even if no scheduler runs.
+    """
+    ids = cache.get(INDEX_CACHE_KEY)
+    metrics.cache_lookup("index", ids is not None)
+    if ids is None:
+        ids = warm_index()
+    return ids
+
+
+def warm_index():
+    """Compute the index question ids and store them in the cache.
+
+    Returns:
+        list: The question ids, newest first.
+    """
+    now = timezone.now()
+    ids = _index_ids(now)
+    timeout = getattr(settings, "POLLS_INDEX_CACHE_TIMEOUT", 60)
+    next_publish = Question.objects.filter(
+        pub_date__gt=now).aggregate(next=Min("pub_date"))["next"]
+    if next_publish is not None:
+        timeout = min(timeout, (next_publish - now).total_seconds())
+    if timeout > 0:
+        cache.set(INDEX_CACHE_KEY, ids, timeout)
+    return ids
+
+
+def invalidate_index():
+    """Drop the cached index."""
+    cache.delete(INDEX_CACHE_KEY)
+
+
+def cache_is_shared():
+    """Return True if the default cache is shared between processes."""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Warn when the index cache cannot be invalidated across processes."""
+    if cache_is_shared():
+        return []
+    return [checks.Warning(
+        "The default cache is private to each process, so run_lifecycle "
+        "and question edits in one server process cannot refresh the "
+        "cached index of the others.",
+        hint="Set CACHE_BACKEND to a shared cache such as Redis, "
+             "Memcached or the database cache.",
+        id="polls.W001")]
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, **kwargs):
+    """Invalidate the index when a question is added, edited or removed."""
+    invalidate_index()
+
+
+class LifecycleScheduler:
+    """Priority queue of upcoming publish and close transitions."""
+
+    def __init__(self):
+        """Initialize an empty schedule."""
+        self.queue = []
+
+    def load(self, now=None):
+        """Schedule every publish and close instant after `now`."""
+        now = now or timezone.now()
+        self.queue = []
+        upcoming = Question.objects.filter(pub_date__gt=now) \
+            .values_list("pub_date", "id")
+        for instant, question_id in upcoming:
+            self.queue.append((instant, PUBLISH, question_id))
+        closing = Question.objects.filter(end_date__gt=now) \
+            .values_list("end_date", "id")
+        for instant, question_id in closing:
+            self.queue.append((instant, CLOSE, question_id))
+        heapq.heapify(self.queue)
+
+    def next_instant(self):
+        """Return the time of the next transition, or None."""
+        return self.queue[0][0] if self.queue else None
+
+    def run_due(self, now=None):
+        """Apply every transition whose instant has passed.
+
+        Returns:
+            list: The (instant, kind, question id) transitions applied.
+        """
+        now = now or timezone.now()
+        applied = []
+        while self.queue and self.queue[0][0] <= now:
+            transition = heapq.heappop(self.queue)
+            self.apply(transition)
+            applied.append(transition)
+        if applied:
+            invalidate_index()
+            warm_index()
+        return applied
+
+    def apply(self, transition):
+        """Apply one transition."""
+        instant, kind, question_id = transition
+        if kind == CLOSE:
+            question = Question.objects.filter(pk=question_id).first()
+            # skip if the poll was deleted or its end date moved
+            if question is not None and question.end_date == instant:
+                freeze_results(question)
+        logger.info(f'Question {question_id}: {kind} at {instant}.')
+
+
+def freeze_closed_questions(now=None):
+    """Freeze the results of closed questions that are not frozen yet.
+
+    Catches up on polls that closed while no scheduler was running.
+
+    Returns:
+        int: Number of questions frozen.
+    """
+    now = now or timezone.now()
+    closed = Question.objects.filter(end_date__lte=now).exclude(
+        result__frozen_at__isnull=False)
+    count = 0
+    for question in closed.iterator():
+        freeze_results(question)
+        count += 1
+    return count
@@ -0,0 +1,48 @@
+"""Measure password verifications per second for each hasher."""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    """Report how many logins per second one core can verify.
+
+    A login costs one password verification, so the verification rate of
+    the preferred hasher is the upper bound on logins/sec per core.
+    """
+
+    help = "Benchmark password verification (logins/sec per core)."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--iterations", type=int, default=20,
+            help="Number of verifications per hasher (default 20).")
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Benchmark every configured hasher, not only the first.")
+
+    def handle(self, *args, **options):
+        """Time password verification for the selected hashers."""
+        hashers = settings.PASSWORD_HASHERS
+        if not options["all"]:
+            hashers = hashers[:1]
+        for path in hashers:
+            name = path.rsplit(".", 1)[-1]
+            hasher = import_string(path)()
+            try:
+                encoded = hasher.encode("benchmark-password", hasher.salt())
+            except ValueError as error:
+                # the algorithm library (e.g. argon2-cffi) is not installed
+                self.stdout.write(f"{name:35} unavailable: {error}")
+                continue
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                hasher.verify("benchmark-password", encoded)
+            elapsed = time.perf_counter() - start
+            per_second = options["iterations"] / elapsed
+            self.stdout.write(
+                f"{name:35} {elapsed / options['iterations'] * 1000:8.1f}"
+                f" ms/login {per_second:8.1f} logins/sec per core")
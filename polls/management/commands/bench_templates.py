@@ -0,0 +1,64 @@
+"""Micro-benchmark the rendering of the polls pages."""
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.urls import reverse
+
+from polls import views
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    """Time each polls view and its template rendering.
+
+    For every page this prints the average time of a full view call
+    (queries included) and of rendering its template alone with the same
+    context, so the effect of TEMPLATE_MODE can be compared directly.
+    """
+
+    help = "Measure render time per polls view."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--iterations", type=int, default=200,
+            help="Number of renders per view (default 200).")
+
+    def handle(self, *args, **options):
+        """Render every page `iterations` times and print the averages."""
+        question = Question.objects.order_by("-pub_date").first()
+        if question is None:
+            raise CommandError("Load some polls first (see Installation).")
+        pages = [
+            ("index", views.IndexView.as_view(), {}),
+            ("detail", views.DetailView.as_view(), {"pk": question.id}),
+            ("results", views.ResultsView.as_view(), {"pk": question.id}),
+        ]
+        factory = RequestFactory()
+        iterations = options["iterations"]
+        self.stdout.write(f"{'view':10} {'view ms':>10} {'render ms':>10}")
+        for name, view, kwargs in pages:
+            request = factory.get(reverse(f"polls:{name}", kwargs=kwargs))
+            request.user = AnonymousUser()
+            response = view(request, **kwargs)
+            if not hasattr(response, "render"):
+                self.stdout.write(f"{name:10} skipped: {response.status_code}")
+                continue
+            template = get_template(response.template_name[0])
+            context = response.context_data
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                view(request, **kwargs).render()
+            view_time = (time.perf_counter() - start) / iterations
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                template.render(context, request)
+            render_time = (time.perf_counter() - start) / iterations
+
+            self.stdout.write(f"{name:10} {view_time * 1000:10.3f} "
+                              f"{render_time * 1000:10.3f}")
@@ -0,0 +1,138 @@
+"""Measure vote write throughput and per-question count latency."""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from polls.models import Choice, Question, Vote
+from polls.results import count_votes
+
+PREFIX = "bench-votes"
+
+
+class Command(BaseCommand):
+    """Fill the vote table with synthetic votes and time it.
+
+    Creates `--questions` questions and `--users` users, and has every user
+    vote on every question, so `questions x users` votes are written in
+    batches. Then times `count_votes()` on single questions, the query the
+    results path runs when it rebuilds totals. Run it against a scratch
+    database, once before and once after `partition_votes`, to compare.
+    The synthetic data is deleted at the end unless `--keep` is given.
+    """
+
+    help = "Benchmark vote inserts and per-question vote counts."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--questions", type=int, default=100,
+            help="Number of questions (default 100).")
+        parser.add_argument(
+            "--users", type=int, default=1000,
+            help="Number of voters, each votes on every question "
+                 "(default 1000).")
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Votes inserted per query (default 5000).")
+        parser.add_argument(
+            "--counts", type=int, default=20,
+            help="Number of per-question counts to time (default 20).")
+        parser.add_argument(
+            "--keep", action="store_true",
+            help="Keep the synthetic questions, users and votes.")
+
+    def handle(self, *args, **options):
+        """Create the data, time the writes and counts, then clean up."""
+        questions, users = self.create_polls(options["questions"],
+                                             options["users"])
+        try:
+            self.time_writes(questions, users, options["batch_size"])
+            self.time_counts(questions, options["counts"])
+        finally:
+            if not options["keep"]:
+                self.cleanup(questions)
+
+    def create_polls(self, question_count, user_count):
+        """Create the questions with two choices each, and the voters.
+
+        Returns:
+            tuple: (list of questions, list of user ids).
+        """
+        now = timezone.now()
+        questions = Question.objects.bulk_create(
+            Question(question_text=f"{PREFIX} {number}", pub_date=now)
+            for number in range(question_count))
+        if not questions[0].pk:  # backends that do not return ids
+            questions = list(Question.objects.filter(
+                question_text__startswith=PREFIX).order_by("id"))
+        Choice.objects.bulk_create(
+            Choice(question=question, choice_text=text)
+            for question in questions for text in ("yes", "no"))
+        User.objects.bulk_create(
+            (User(username=f"{PREFIX}-{number}", password="!")
+             for number in range(user_count)), batch_size=1000)
+        users = list(User.objects.filter(username__startswith=PREFIX)
+                     .values_list("id", flat=True))
+        return questions, users
+
+    def time_writes(self, questions, users, batch_size):
+        """Insert one vote per user and question, and report the rate."""
+        choices = {}
+        for choice in Choice.objects.filter(question__in=questions):
+            choices.setdefault(choice.question_id, []).append(choice.id)
+        total = 0
+        start = time.perf_counter()
+        batch = []
+        for question in questions:
+            yes, no = choices[question.id]
+            for index, user_id in enumerate(users):
+                batch.append(Vote(question_id=question.id, user_id=user_id,
+                                  choice_id=yes if index % 3 else no))
+                if len(batch) >= batch_size:
+                    total += self.insert(batch)
+                    batch = []
+        total += self.insert(batch)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"inserted {total} votes in {elapsed:.1f} s: "
+                          f"{total / elapsed:,.0f} votes/sec")
+
+    def insert(self, batch):
+        """Insert a batch of votes in one transaction.
+
+        Returns:
+            int: Number of votes inserted.
+        """
+        with transaction.atomic():
+            Vote.objects.bulk_create(batch)
+        return len(batch)
+
+    def time_counts(self, questions, count):
+        """Time counting the votes of single questions."""
+        step = max(1, len(questions) // count)
+        timings = []
+        for question in questions[::step][:count]:
+            start = time.perf_counter()
+            count_votes(question)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(
+            f"count_votes over {len(timings)} questions: "
+            f"median {timings[len(timings) // 2] * 1000:.1f} ms, "
+            f"max {timings[-1] * 1000:.1f} ms")
+
+    def cleanup(self, questions):
+        """Delete the synthetic votes, questions and users.
+
+        Votes are deleted with one raw query per question, so millions of
+        rows are not loaded to send `post_delete` signals.
+        """
+        with connection.cursor() as cursor:
+            for question in questions:
+                cursor.execute(
+                    f"DELETE FROM {Vote._meta.db_table} "
+                    f"WHERE question_id = %s", [question.id])
+        Question.objects.filter(question_text__startswith=PREFIX).delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
@@ -0,0 +1,42 @@
+"""Compare the precomputed results with the raw votes."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import Question
+from polls.results import check_results, refresh_results
+
+
+class Command(BaseCommand):
+    """Report questions whose `QuestionResult` disagrees with `Vote` rows.
+
+    Exits with an error when a mismatch is found, so it can run from cron
+    or CI. With `--fix`, mismatched questions are rebuilt from the votes.
+    """
+
+    help = "Check question results against the Vote table."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--fix", action="store_true",
+            help="Rebuild the results of inconsistent questions.")
+
+    def handle(self, *args, **options):
+        """Check every question that has results."""
+        questions = Question.objects.filter(
+            result__isnull=False).order_by("id")
+        inconsistent = 0
+        for question in questions.iterator():
+            problems = check_results(question)
+            if not problems:
+                continue
+            inconsistent += 1
+            for problem in problems:
+                self.stdout.write(f"Question {question.id}: {problem}")
+            if options["fix"]:
+                refresh_results(question)
+                self.stdout.write(f"Question {question.id}: fixed")
+        if inconsistent and not options["fix"]:
+            raise CommandError(
+                f"{inconsistent} questions have inconsistent results.")
+        self.stdout.write(f"Checked {questions.count()} questions, "
+                          f"{inconsistent} inconsistent.")
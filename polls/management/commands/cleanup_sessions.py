@@ -0,0 +1,66 @@
+"""Delete expired sessions in small batches."""
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    """Remove expired sessions, optionally on a schedule.
+
+    With database sessions, expired rows are deleted in batches so the
+    `django_session` table is never locked for long. Other session engines
+    use their own `clear_expired()`. Run it from cron, or pass `--interval`
+    to keep it running.
+    """
+
+    help = "Delete expired sessions in batches, once or every N seconds."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of sessions deleted per query (default 1000).")
+        parser.add_argument(
+            "--interval", type=int, default=0, metavar="SECONDS",
+            help="Repeat every SECONDS seconds instead of running once.")
+
+    def handle(self, *args, **options):
+        """Clean up once, or forever when an interval is given."""
+        while True:
+            deleted = self.cleanup(options["batch_size"])
+            if deleted is None:
+                self.stdout.write("Cleared expired sessions.")
+            else:
+                self.stdout.write(f"Deleted {deleted} expired sessions.")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def cleanup(self, batch_size):
+        """Delete expired sessions.
+
+        Returns:
+            int: Number of rows deleted, or None if the session engine does
+                 not store sessions in the database.
+        """
+        engine = settings.SESSION_ENGINE
+        if engine not in ("django.contrib.sessions.backends.db",
+                          "django.contrib.sessions.backends.cached_db"):
+            try:
+                import_module(engine).SessionStore.clear_expired()
+            except NotImplementedError:
+                self.stderr.write(
+                    f"{engine} does not support clearing expired sessions.")
+            return None
+        expired = Session.objects.filter(expire_date__lt=timezone.now())
+        deleted = 0
+        while True:
+            keys = list(expired.values_list("session_key", flat=True)
+                        [:batch_size])
+            if not keys:
+                return deleted
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
@@ -0,0 +1,47 @@
+"""Aggregate the structured event stream by minute."""
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from polls import events
+
+
+class Command(BaseCommand):
+    """Print per-minute event counts read from the configured event sink.
+
+    The counts come from the event stream only, so this never scans the
+    `Vote` table. Events still buffered by the server processes are not
+    written yet, so the last `POLLS_EVENT_FLUSH_INTERVAL` seconds may be
+    missing from the counts.
+    """
+
+    help = "Aggregate vote and login events by minute."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--since", type=int, default=None, metavar="MINUTES",
+            help="Only count events from the last MINUTES minutes.")
+        parser.add_argument(
+            "--type", action="append", dest="event_types",
+            choices=events.EVENT_TYPES,
+            help="Only count this event type (may be repeated).")
+
+    def handle(self, *args, **options):
+        """Print the per-minute counts."""
+        since = None
+        if options["since"] is not None:
+            since = timezone.now() - datetime.timedelta(
+                minutes=options["since"])
+        event_types = options["event_types"] or events.EVENT_TYPES
+        buckets = events.aggregate_by_minute(
+            events.get_sink().read(), event_types, since)
+        if not buckets:
+            self.stdout.write("No events recorded.")
+            return
+        self.stdout.write("minute            " + " ".join(
+            f"{name:>13}" for name in event_types))
+        for minute, counts in buckets.items():
+            self.stdout.write(minute.replace("T", " ") + "  " + " ".join(
+                f"{counts[name]:>13}" for name in event_types))
@@ -0,0 +1,52 @@
+"""Import questions with their choices from a CSV or JSON file."""
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import importer
+
+
+class Command(BaseCommand):
+    """Bulk-create polls from a file, all or nothing.
+
+    See `polls/importer.py` for the file formats.
+    """
+
+    help = "Import questions and choices from a CSV or JSON file."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument("path", help="The CSV or JSON file to import.")
+        parser.add_argument(
+            "--format", choices=importer.FORMATS, default=None,
+            help="File format (default: from the file extension).")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Rows inserted per query (default 1000).")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only validate the file.")
+
+    def handle(self, *args, **options):
+        """Import the file and report the throughput."""
+        file_format = options["format"] or importer.guess_format(
+            options["path"])
+        if file_format is None:
+            raise CommandError("Cannot tell the file format, use --format.")
+        try:
+            with open(options["path"], encoding="utf-8-sig") as file:
+                content = file.read()
+        except OSError as error:
+            raise CommandError(str(error))
+        try:
+            report = importer.import_polls(
+                content, file_format, options["batch_size"],
+                options["dry_run"])
+        except ValidationError as error:
+            raise CommandError("\n".join(["Nothing was imported:",
+                                          *error.messages]))
+        verb = "Would import" if options["dry_run"] else "Imported"
+        seconds = report["seconds"]
+        self.stdout.write(
+            f"{verb} {report['questions']} questions and "
+            f"{report['choices']} choices in {seconds:.2f} s "
+            f"({report['questions'] / max(seconds, 1e-9):,.0f} polls/sec).")
@@ -0,0 +1,124 @@
+"""Convert the vote table into a hash-partitioned Postgres table."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from polls.models import Vote
+
+
+class Command(BaseCommand):
+    """Partition `polls_vote` by question with Postgres declarative hashing.
+
+    Every vote of a question lands in the same partition, and the vote
+    and results paths always filter votes by question, so each of their
+    queries only touches one partition. The table is rebuilt in a single
+    transaction: votes are copied into the new partitioned table, and its
+    indexes, unique constraints and foreign keys are recreated under their
+    old names. The primary key becomes (id, question_id), as Postgres
+    requires the partition key in every unique constraint.
+    """
+
+    help = "Hash-partition the vote table by question (Postgres only)."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--partitions", type=int, default=16,
+            help="Number of hash partitions (default 16).")
+        parser.add_argument(
+            "--database", default="default",
+            help="Database to partition (default 'default').")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Print the SQL instead of running it.")
+
+    def handle(self, *args, **options):
+        """Check the database, then rebuild the vote table."""
+        connection = connections[options["database"]]
+        if connection.vendor != "postgresql":
+            raise CommandError(
+                "Partitioned vote storage needs PostgreSQL, this database "
+                f"is {connection.vendor}.")
+        if options["partitions"] < 1:
+            raise CommandError("--partitions must be at least 1.")
+        table = Vote._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE oid = %s::regclass",
+                [table])
+            if cursor.fetchone()[0] == "p":
+                self.stdout.write(f"{table} is already partitioned.")
+                return
+            statements = self.build_sql(cursor, connection, table,
+                                        options["partitions"])
+        if options["dry_run"]:
+            self.stdout.write(";\n".join(statements) + ";")
+            return
+        with transaction.atomic(using=options["database"]):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+        self.stdout.write(
+            f"Partitioned {table} into {options['partitions']} partitions.")
+
+    def build_sql(self, cursor, connection, table, partitions):
+        """Return the statements that rebuild `table` as partitioned.
+
+        Args:
+            cursor: A cursor used to read the current indexes and keys.
+            connection: The database connection, for quoting names.
+            table (str): The vote table name.
+            partitions (int): Number of hash partitions.
+
+        Returns:
+            list: SQL statements, to run in one transaction.
+        """
+        quote = connection.ops.quote_name
+        old = f"{table}_unpartitioned"
+        # the definitions name the table as it is now, which is the new
+        # table by the time they run; the old table, which still owns the
+        # index and constraint names, is dropped first; the indexes of
+        # unique constraints are left out, they come back with them
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = %s::regclass AND NOT indisprimary "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint "
+            "WHERE conrelid = indrelid AND conindid = indexrelid)", [table])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('u', 'f') "
+            "ORDER BY contype DESC, conname", [table])
+        constraints = cursor.fetchall()
+        sequence = f"{table}_id_seq"
+        statements = [
+            f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE",
+            f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}",
+            # no INCLUDING DEFAULTS: the id default belongs to the old table
+            f"CREATE TABLE {quote(table)} (LIKE {quote(old)}) "
+            f"PARTITION BY HASH (question_id)",
+        ]
+        statements += [
+            f"CREATE TABLE {quote(f'{table}_p{number}')} PARTITION OF "
+            f"{quote(table)} FOR VALUES WITH (MODULUS {partitions}, "
+            f"REMAINDER {number})"
+            for number in range(partitions)
+        ]
+        statements += [
+            f"INSERT INTO {quote(table)} SELECT * FROM {quote(old)}",
+            f"DROP TABLE {quote(old)}",
+            f"CREATE SEQUENCE {quote(sequence)} "
+            f"OWNED BY {quote(table)}.id",
+            f"ALTER TABLE {quote(table)} ALTER COLUMN id "
+            f"SET DEFAULT nextval('{sequence}')",
+            f"SELECT setval('{sequence}', "
+            f"COALESCE((SELECT MAX(id) FROM {quote(table)}), 0) + 1, false)",
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT "
+            f"{quote(f'{table}_pkey')} PRIMARY KEY (id, question_id)",
+        ]
+        statements += indexes
+        statements += [
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} "
+            f"{definition}"
+            for name, definition in constraints
+        ]
+        return statements
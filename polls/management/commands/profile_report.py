@@ -0,0 +1,112 @@
+"""Summarize the profiles written by the profiling middleware."""
+import collections
+import glob
+import io
+import json
+import os
+import pstats
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# numbers and quoted strings, replaced so equal queries group together
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def view_name(path):
+    """Return the view name a profile file was written for."""
+    return os.path.basename(path).split("-", 1)[0]
+
+
+class Command(BaseCommand):
+    """Print the hottest functions and queries of each profiled view."""
+
+    help = "Summarize profiled requests by view."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--dir", default=None,
+            help="Directory to read (default: POLLS_PROFILING_DIR).")
+        parser.add_argument(
+            "--view", default=None,
+            help="Only report this view, e.g. polls.vote.")
+        parser.add_argument(
+            "--limit", type=int, default=10,
+            help="Number of functions and queries to show per view.")
+        parser.add_argument(
+            "--sort", default="cumulative",
+            choices=["cumulative", "tottime", "ncalls"],
+            help="Order of the function table.")
+
+    def handle(self, *args, **options):
+        """Group the profile files by view and print each summary."""
+        directory = options["dir"] or getattr(
+            settings, "POLLS_PROFILING_DIR", "profiles")
+        by_view = collections.defaultdict(list)
+        for path in sorted(glob.glob(os.path.join(directory, "*-*"))):
+            by_view[view_name(path)].append(path)
+        if options["view"]:
+            by_view = {options["view"]: by_view.get(options["view"], [])}
+        if not any(by_view.values()):
+            self.stdout.write("No profiles recorded.")
+            return
+        for view, paths in sorted(by_view.items()):
+            traces = [path for path in paths if path.endswith(".sql.json")]
+            self.stdout.write(f"== {view} ({len(traces)} requests)")
+            self.report_functions(
+                [path for path in paths if path.endswith(".prof")],
+                options["sort"], options["limit"])
+            self.report_samples(
+                [path for path in paths if path.endswith(".stacks")],
+                options["limit"])
+            self.report_queries(traces, options["limit"])
+
+    def report_functions(self, paths, sort, limit):
+        """Print the top functions of the merged cProfile files."""
+        if not paths:
+            return
+        out = io.StringIO()
+        stats = pstats.Stats(*paths, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        self.stdout.write(out.getvalue().strip())
+
+    def report_samples(self, paths, limit):
+        """Print the functions found most often in the stack samples."""
+        if not paths:
+            return
+        own = collections.Counter()
+        total = 0
+        for path in paths:
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    stack, count = line.rsplit(" ", 1)
+                    own[stack.rsplit(";", 1)[-1]] += int(count)
+                    total += int(count)
+        self.stdout.write(f"{total} samples, hottest functions:")
+        for function, count in own.most_common(limit):
+            self.stdout.write(f"{100 * count / total:6.1f}%  {function}")
+
+    def report_queries(self, paths, limit):
+        """Print the queries that took the most total time."""
+        elapsed = []
+        durations = collections.Counter()
+        counts = collections.Counter()
+        for path in paths:
+            with open(path, encoding="utf-8") as file:
+                trace = json.load(file)
+            elapsed.append(trace["elapsed"])
+            for query in trace["queries"]:
+                sql = LITERALS.sub("?", query["sql"])
+                durations[sql] += query["duration"]
+                counts[sql] += 1
+        if not elapsed:
+            return
+        self.stdout.write(
+            f"mean request {1000 * sum(elapsed) / len(elapsed):.1f} ms, "
+            f"{sum(counts.values()) / len(elapsed):.1f} queries")
+        self.stdout.write("  total ms  count  query")
+        for sql, duration in durations.most_common(limit):
+            self.stdout.write(
+                f"{1000 * duration:10.2f} {counts[sql]:6}  {sql[:200]}")
@@ -0,0 +1,28 @@
+"""Rebuild the precomputed results from the raw votes."""
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+from polls.results import refresh_results
+
+
+class Command(BaseCommand):
+    """Recount the votes of some or all questions into `QuestionResult`."""
+
+    help = "Rebuild question results from the Vote table."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "question_ids", nargs="*", type=int, metavar="QUESTION_ID",
+            help="Questions to refresh (default: all questions).")
+
+    def handle(self, *args, **options):
+        """Refresh the selected questions."""
+        questions = Question.objects.order_by("id")
+        if options["question_ids"]:
+            questions = questions.filter(pk__in=options["question_ids"])
+        count = 0
+        for question in questions.iterator():
+            refresh_results(question)
+            count += 1
+        self.stdout.write(f"Refreshed results of {count} questions.")
@@ -0,0 +1,58 @@
+"""Apply poll publish/close transitions as they happen."""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.lifecycle import (LifecycleScheduler, cache_is_shared,
+                             freeze_closed_questions, warm_index)
+
+
+class Command(BaseCommand):
+    """Run the poll lifecycle scheduler.
+
+    Sleeps until the next publish or close instant, then invalidates and
+    warms the index cache, and freezes the final results of closed polls.
+    The schedule is reloaded at least every `--max-sleep` seconds to pick
+    up new or edited questions. Needs a cache shared with the web server,
+    or its index refreshes would only reach its own process; `--once`
+    only freezes results and works with any cache.
+    """
+
+    help = "Freeze results and refresh the index at publish/close times."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Apply the overdue transitions and exit.")
+        parser.add_argument(
+            "--max-sleep", type=float, default=60, metavar="SECONDS",
+            help="Longest sleep between schedule reloads (default 60).")
+
+    def handle(self, *args, **options):
+        """Catch up on closed polls, then follow the schedule."""
+        if not options["once"] and not cache_is_shared():
+            raise CommandError(
+                "run_lifecycle needs a cache shared with the web server; "
+                "the default cache is private to this process. Set "
+                "CACHE_BACKEND, or use --once to only freeze results.")
+        frozen = freeze_closed_questions()
+        warm_index()
+        self.stdout.write(f"Froze results of {frozen} closed questions.")
+        if options["once"]:
+            return
+        scheduler = LifecycleScheduler()
+        last_run = timezone.now()
+        while True:
+            # transitions after the last run, each applied exactly once
+            scheduler.load(last_run)
+            now = timezone.now()
+            for instant, kind, question_id in scheduler.run_due(now):
+                self.stdout.write(f"{instant}: {kind} question {question_id}")
+            last_run = now
+            sleep = options["max_sleep"]
+            next_instant = scheduler.next_instant()
+            if next_instant is not None:
+                sleep = min(sleep, (next_instant - now).total_seconds())
+            time.sleep(max(sleep, 0.1))
@@ -0,0 +1,374 @@
+"""Prometheus-style metrics for the polls app.
+
+Metrics are updated on the request path without taking a lock: every
+thread writes to its own shard, and the shards are only added up when
+the metrics are collected. With several server workers, set
+`POLLS_METRICS_DIR` to a directory shared by the workers. Each process
+then writes a snapshot of its metrics there every
+`POLLS_METRICS_FLUSH_INTERVAL` seconds and at exit, and the `/metrics`
+endpoint adds up the snapshots of all processes. The endpoint is only
+served once `POLLS_METRICS_TOKEN` is set, to scrapers that send it.
+"""
+import atexit
+import bisect
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+class Metric:
+    """A named metric whose values are kept per label values.
+
+    Each thread updates its own dictionary of values (a shard), so an
+    update never waits for another thread. When a thread creates its
+    shard, the shards of threads that have ended are added into one
+    retired shard and dropped, so there is at most one shard per live
+    thread however many threads the server starts over time.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Initialize and register the metric.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labelnames (tuple): Names of the labels, in order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self):
+        """Return the shard of the current thread."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_dead_shards(self):
+        """Merge the shards of ended threads. Caller holds the lock."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for key, value in shard.items():
+                self._retired[key] = self.merge(self._retired.get(key), value)
+        self._shards = live
+
+    def _key(self, labels):
+        """Return the label values of `labels` as a tuple key."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        """Return the values of this process, keyed by label values."""
+        with self._lock:
+            shards = [self._retired.copy()]
+            shards.extend(shard.copy() for _, shard in self._shards)
+        total = {}
+        for shard in shards:
+            for key, value in shard.items():
+                total[key] = self.merge(total.get(key), value)
+        return total
+
+    def merge(self, first, second):
+        """Return the sum of two values (`first` may be None)."""
+        return second if first is None else first + second
+
+    def reset(self):
+        """Forget every value (used by tests)."""
+        with self._lock:
+            self._retired.clear()
+            for _, shard in self._shards:
+                shard.clear()
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Add `amount` to the counter for the given labels."""
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, values):
+        """Yield (suffix, labels, value) for the exposition format."""
+        for key, value in values.items():
+            yield "", key, (), value
+
+
+class StatsCounter(Counter):
+    """A counter that reports an existing `collections.Counter`.
+
+    Used to export counters a module already keeps, such as
+    `ratelimit.stats`, without counting twice on the request path.
+    """
+
+    def __init__(self, name, documentation, labelname, source):
+        """Initialize the metric.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labelname (str): The label holding the counter's keys.
+            source (callable): Returns the counter to export.
+        """
+        super().__init__(name, documentation, (labelname,))
+        self.source = source
+
+    def values(self):
+        """Return the current values of the source counter."""
+        return {(str(key),): value for key, value in self.source().items()}
+
+
+class Histogram(Metric):
+    """Count observations in buckets, with their sum and count.
+
+    A value is a list holding the count of each bucket (not cumulative),
+    then the sum and the number of observations.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        """Initialize the histogram with the upper bounds `buckets`."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record one observation of `value`."""
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def merge(self, first, second):
+        """Add two bucket lists element by element."""
+        if first is None:
+            return list(second)
+        return [a + b for a, b in zip(first, second)]
+
+    def samples(self, values):
+        """Yield the cumulative buckets, the sum and the count."""
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "_bucket", key, (("le", _bound(bound)),), cumulative
+            yield "_sum", key, (), counts[-2]
+            yield "_count", key, (), counts[-1]
+
+
+def _bound(bound):
+    """Format a bucket bound the way Prometheus does."""
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+REQUESTS = Counter(
+    "polls_http_requests_total", "HTTP requests by URL name.",
+    ("view", "method", "status"))
+REQUEST_LATENCY = Histogram(
+    "polls_http_request_duration_seconds",
+    "Time to produce a response, by URL name.", ("view",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    "polls_db_queries_per_request", "Database queries per request.",
+    ("view",), buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+VOTES = Counter(
+    "polls_votes_total",
+    "Votes recorded; kind is created, updated, coalesced, guest_created "
+    "or guest_updated.", ("kind",))
+LOGIN_FAILURES = Counter(
+    "polls_login_failures_total", "Failed login attempts.")
+CACHE_REQUESTS = Counter(
+    "polls_cache_requests_total", "Cache lookups by cache and result.",
+    ("cache", "result"))
+
+
+def _ratelimit_stats():
+    """Return the rate limiting counters."""
+    from . import ratelimit
+    return ratelimit.stats
+
+
+RATELIMIT = StatsCounter(
+    "polls_ratelimit_events_total", "Rate limiting decisions.", "event",
+    _ratelimit_stats)
+
+
+def cache_lookup(name, hit):
+    """Count a hit or a miss of the cache `name`."""
+    CACHE_REQUESTS.inc(cache=name, result="hit" if hit else "miss")
+
+
+def snapshot():
+    """Return the values of every metric of this process as plain data."""
+    return {metric.name: [[list(key), value]
+                          for key, value in metric.values().items()]
+            for metric in _registry}
+
+
+def _snapshot_path(directory, pid):
+    """Return the snapshot file of the process `pid`."""
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def write_snapshot():
+    """Write this process's snapshot to `POLLS_METRICS_DIR`, if set."""
+    directory = getattr(settings, "POLLS_METRICS_DIR", "")
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(snapshot(), file)
+    # replace atomically so a reader never sees a half-written file
+    os.replace(path + ".tmp", path)
+
+
+atexit.register(write_snapshot)
+
+
+def collect():
+    """Add up the metrics of this process and of the other processes.
+
+    Returns:
+        dict: Values keyed by metric name, then by label values.
+    """
+    totals = {metric.name: metric.values() for metric in _registry}
+    directory = getattr(settings, "POLLS_METRICS_DIR", "")
+    if not directory:
+        return totals
+    own = _snapshot_path(directory, os.getpid())
+    by_name = {metric.name: metric for metric in _registry}
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, values in data.items():
+            if name not in by_name:
+                continue
+            merged = totals[name]
+            for key, value in values:
+                key = tuple(key)
+                merged[key] = by_name[name].merge(merged.get(key), value)
+    return totals
+
+
+def exposition():
+    """Render every metric in the Prometheus text format."""
+    totals = collect()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, key, extra, value in metric.samples(totals[metric.name]):
+            labels = list(zip(metric.labelnames, key)) + list(extra)
+            text = ",".join(f'{name}="{_escape(label)}"'
+                            for name, label in labels)
+            lines.append(f"{metric.name}{suffix}"
+                         f"{'{' + text + '}' if text else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def metrics_view(request):
+    """Serve the metrics in the Prometheus text format.
+
+    Returns 404 when `POLLS_METRICS` is off or no `POLLS_METRICS_TOKEN` is
+    set, so the metrics are never public. The request must send the token
+    as a bearer token.
+    """
+    token = getattr(settings, "POLLS_METRICS_TOKEN", "")
+    if not getattr(settings, "POLLS_METRICS", True) or not token:
+        raise Http404
+    if request.META.get("HTTP_AUTHORIZATION") != f"Bearer {token}":
+        raise PermissionDenied
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+class QueryCounter:
+    """Database execute wrapper that counts queries."""
+
+    def __init__(self):
+        """Start counting from zero."""
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count the query and run it."""
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Count requests, their latency and their queries per URL name.
+
+    Should come first so the latency covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        """Initialize the middleware."""
+        self.get_response = get_response
+        self.interval = getattr(settings, "POLLS_METRICS_FLUSH_INTERVAL", 5)
+        self.last_flush = time.monotonic()
+
+    def __call__(self, request):
+        """Handle the request and record its metrics."""
+        counter = QueryCounter()
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(counter))
+            start = time.perf_counter()
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        REQUESTS.inc(view=view, method=request.method,
+                     status=response.status_code)
+        REQUEST_LATENCY.observe(elapsed, view=view)
+        REQUEST_QUERIES.observe(counter.count, view=view)
+        now = time.monotonic()
+        if now - self.last_flush >= self.interval:
+            self.last_flush = now
+            write_snapshot()
+        return response
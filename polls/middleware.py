@@ -0,0 +1,152 @@
+"""Middleware for the polls site."""
+import json
+import mimetypes
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+from django.middleware.gzip import GZipMiddleware
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# hashed assets never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files before the rest of the stack runs.
+
+    The files in `STATIC_ROOT` are indexed once when the middleware is
+    created, so a request for an asset costs a dictionary lookup and an
+    `open()`: no URL resolving, session or authentication work. Responses
+    are `FileResponse`s, which WSGI servers such as gunicorn send with
+    `sendfile()`. Precompressed `.br`/`.gz` copies are served to clients
+    that accept them, and fingerprinted files listed in the manifest get
+    far-future cache headers.
+
+    Enabled by the `STATIC_SERVE` setting; requests for unknown files fall
+    through to Django.
+    """
+
+    encodings = (("br", ".br"), ("gzip", ".gz"))
+
+    def __init__(self, get_response):
+        """Index the collected static files."""
+        self.get_response = get_response
+        self.prefix = "/" + settings.STATIC_URL.lstrip("/")
+        self.files = {}
+        if getattr(settings, "STATIC_SERVE", False) and settings.STATIC_ROOT:
+            self.files = self.index(Path(settings.STATIC_ROOT))
+
+    def __call__(self, request):
+        """Return the static file for the request, or call the next layer."""
+        static = request.path_info.startswith(self.prefix)
+        if self.files and static and request.method in ("GET", "HEAD"):
+            entry = self.files.get(request.path_info[len(self.prefix):])
+            if entry is not None:
+                return self.serve(request, entry)
+        return self.get_response(request)
+
+    def index(self, root):
+        """Map each URL path below `STATIC_URL` to its file details."""
+        immutable = set()
+        try:
+            with open(root / "staticfiles.json", encoding="utf-8") as file:
+                immutable.update(json.load(file).get("paths", {}).values())
+        except (OSError, ValueError):
+            pass
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith((".gz", ".br")):
+                    continue
+                path = os.path.join(directory, filename)
+                name = Path(path).relative_to(root).as_posix()
+                content_type, _ = mimetypes.guess_type(filename)
+                files[name] = {
+                    "path": path,
+                    "mtime": os.stat(path).st_mtime,
+                    "content_type": content_type or "application/octet-stream",
+                    "immutable": name in immutable,
+                    "encodings": [
+                        (encoding, suffix) for encoding, suffix
+                        in self.encodings if os.path.exists(path + suffix)
+                    ],
+                }
+        return files
+
+    def serve(self, request, entry):
+        """Return the best encoding of a static file the client accepts."""
+        if not was_modified_since(
+                request.META.get("HTTP_IF_MODIFIED_SINCE"), entry["mtime"]):
+            return self.add_cache_headers(HttpResponseNotModified(), entry)
+        accepted = accepted_encodings(
+            request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        path, content_encoding = entry["path"], None
+        for encoding, suffix in entry["encodings"]:
+            if accepted.get(encoding, accepted.get("*", 0)) > 0:
+                path, content_encoding = path + suffix, encoding
+                break
+        response = FileResponse(open(path, "rb"),
+                                content_type=entry["content_type"])
+        # the file name may be the .gz/.br copy, so do not advertise it
+        response.headers.pop("Content-Disposition", None)
+        if content_encoding:
+            response.headers["Content-Encoding"] = content_encoding
+        response.headers["Last-Modified"] = http_date(entry["mtime"])
+        return self.add_cache_headers(response, entry)
+
+    def add_cache_headers(self, response, entry):
+        """Set the caching headers of a file on a 200 or 304 response."""
+        if entry["encodings"]:
+            response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = (
+            IMMUTABLE_CACHE_CONTROL if entry["immutable"]
+            else "public, max-age=60")
+        return response
+
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header.
+
+    Args:
+        header (str): The header value, e.g. "gzip;q=1.0, br;q=0".
+
+    Returns:
+        dict: The quality value of each listed coding, lowercased. A
+              coding with q=0 is listed with 0, meaning not acceptable.
+    """
+    accepted = {}
+    for item in header.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip responses that are at least `RESPONSE_COMPRESSION_MIN_SIZE` long.
+
+    Django's `GZipMiddleware` with a configurable size threshold and an
+    on/off switch (`RESPONSE_COMPRESSION`). Streaming responses are always
+    compressed chunk by chunk, since their size is unknown.
+    """
+
+    def process_response(self, request, response):
+        """Compress the response if enabled and large enough."""
+        if not getattr(settings, "RESPONSE_COMPRESSION", True):
+            return response
+        min_size = getattr(settings, "RESPONSE_COMPRESSION_MIN_SIZE", 1024)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+        return super().process_response(request, response)
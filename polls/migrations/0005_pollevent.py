@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=32)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('username', models.CharField(blank=True, max_length=150)),
+                ('question_id', models.IntegerField(blank=True, null=True)),
+                ('choice_id', models.IntegerField(blank=True, null=True)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+            ],
+        ),
+    ]
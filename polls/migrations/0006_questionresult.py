@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_pollevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voter_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='polls.question')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChoiceResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='polls.choice')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='choices', to='polls.questionresult')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_questionresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionresult',
+            name='frozen_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_vote_question(apps, schema_editor):
+    """Copy each vote's question from its choice."""
+    Choice = apps.get_model("polls", "Choice")
+    Vote = apps.get_model("polls", "Vote")
+    Vote.objects.update(question_id=Subquery(
+        Choice.objects.filter(pk=OuterRef("choice_id"))
+        .values("question_id")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_questionresult_frozen_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(fill_vote_question, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_vote_question_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='allow_guests',
+            field=models.BooleanField(default=False, verbose_name='allow guest votes'),
+        ),
+        migrations.CreateModel(
+            name='GuestVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.BigIntegerField()),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('question', 'token_hash'), name='polls_guestvote_one_per_device')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of each user on each question.
+
+    Two concurrent first votes of a user could both be saved before the
+    constraint existed. Run `refresh_results` afterwards, as the stored
+    totals counted both.
+    """
+    Vote = apps.get_model("polls", "Vote")
+    duplicates = (Vote.objects.values("question", "user")
+                  .annotate(count=Count("id"), latest=Max("id"))
+                  .filter(count__gt=1))
+    for row in duplicates.iterator():
+        Vote.objects.filter(question=row["question"], user=row["user"],
+                            id__lt=row["latest"]).delete()
+
+
+class Migration(migrations.Migration):
+    """Allow a single vote per user and question.
+
+    The constraint includes the question, so it can be kept when the vote
+    table is partitioned by question.
+    """
+
+    dependencies = [
+        ('polls', '0010_guestvote'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='vote',
+            name='polls_vote_question_user',
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('question', 'user'), name='polls_vote_question_user'),
+        ),
+    ]
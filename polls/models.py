@@ -1,6 +1,8 @@
 """Contains the models for the Polls app."""
 import datetime
 from django.db import models
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.contrib import admin
 
@@ -13,6 +15,8 @@ class Question(models.Model):
         pub_date (datetime): Date the question was published.
         end_date (datetime): Date the question will end. If null, can be voted
                              on indefinitely.
+        allow_guests (bool): Whether visitors without an account can vote,
+                             once per device.
     """
 
     question_text = models.CharField(max_length=200)
@@ -20,6 +24,7 @@ class Question(models.Model):
     end_date = models.DateTimeField(
         "date ended", auto_now_add=False, null=True, blank=True, default=None
     )
+    allow_guests = models.BooleanField("allow guest votes", default=False)
 
     @admin.display(
         boolean=True,
@@ -86,7 +91,150 @@ class Choice(models.Model):
 
 
 class Vote(models.Model):
-    """A vote by a user for a choice in a poll."""
+    """A vote by a user for a choice in a poll.
 
+    Attributes:
+        question (Question): The question of the choice, stored on the vote
+                             so votes are found and counted per question
+                             without joining `Choice`, and so the table can
+                             be partitioned by question (`partition_votes`).
+        choice (Choice): The choice voted for.
+        user (User): The voter.
+    """
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey("auth.User", on_delete=models.CASCADE)
+
+    class Meta:
+        """One vote per user and question, enforced by the database."""
+
+        constraints = [
+            models.UniqueConstraint(fields=["question", "user"],
+                                    name="polls_vote_question_user"),
+        ]
+
+
+class GuestVote(models.Model):
+    """A vote cast without an account, on a question that allows guests.
+
+    Attributes:
+        question (Question): The question voted on.
+        choice (Choice): The choice voted for.
+        token_hash (int): 64-bit hash of the voter's signed device token.
+                          The token itself is never stored.
+    """
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    token_hash = models.BigIntegerField()
+
+    class Meta:
+        """One vote per device and question, enforced by the database."""
+
+        constraints = [
+            models.UniqueConstraint(fields=["question", "token_hash"],
+                                    name="polls_guestvote_one_per_device"),
+        ]
+
+
+@receiver(pre_save, sender=Vote)
+def set_vote_question(sender, instance, **kwargs):
+    """Set the question of a vote from its choice.
+
+    Always set, so a vote whose choice changed can never keep the question
+    of its old choice. A receiver rather than `save()` so votes loaded
+    with `loaddata` get their question too.
+    """
+    instance.question_id = instance.choice.question_id
+
+
+class PollEvent(models.Model):
+    """A structured vote or authentication event written by the event sink.
+
+    Attributes:
+        event_type (str): Kind of event, see `polls.events.EVENT_TYPES`.
+        timestamp (datetime): When the event happened.
+        username (str): User the event is about, if any.
+        question_id (int): Question voted on, for vote events.
+        choice_id (int): Choice voted for, for vote events.
+        ip (str): Client IP address, for authentication events.
+    """
+
+    event_type = models.CharField(max_length=32)
+    timestamp = models.DateTimeField(db_index=True)
+    username = models.CharField(max_length=150, blank=True)
+    question_id = models.IntegerField(null=True, blank=True)
+    choice_id = models.IntegerField(null=True, blank=True)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+
+    @classmethod
+    def from_event(cls, event):
+        """Build an unsaved row from an event dictionary."""
+        return cls(
+            event_type=event["type"],
+            timestamp=datetime.datetime.fromisoformat(event["timestamp"]),
+            username=event.get("username") or "",
+            question_id=event.get("question_id"),
+            choice_id=event.get("choice_id"),
+            ip=event.get("ip"),
+        )
+
+    def to_event(self):
+        """Return the row as an event dictionary."""
+        event = {
+            "type": self.event_type,
+            "timestamp": self.timestamp.astimezone(
+                datetime.timezone.utc).isoformat(),
+        }
+        for field in ("username", "question_id", "choice_id", "ip"):
+            value = getattr(self, field)
+            if value not in (None, ""):
+                event[field] = value
+        return event
+
+    def __str__(self):
+        """Return the event type and time."""
+        return f"{self.event_type} at {self.timestamp}"
+
+
+class QuestionResult(models.Model):
+    """Precomputed results of a question, kept up to date by each vote.
+
+    Attributes:
+        question (Question): The question these results belong to.
+        voter_count (int): Number of users who voted on the question.
+        updated_at (datetime): When the results last changed.
+        frozen_at (datetime): When the final results of a closed question
+                              were recorded, or None while it is open.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    related_name="result")
+    voter_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    frozen_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        """Return the question and its number of voters."""
+        return f"{self.question}: {self.voter_count} voters"
+
+
+class ChoiceResult(models.Model):
+    """Precomputed vote total of one choice, part of a `QuestionResult`.
+
+    Attributes:
+        result (QuestionResult): The results this total belongs to.
+        choice (Choice): The choice being counted.
+        votes (int): Number of votes for the choice.
+    """
+
+    result = models.ForeignKey(QuestionResult, on_delete=models.CASCADE,
+                               related_name="choices")
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE,
+                                  related_name="result")
+    votes = models.IntegerField(default=0)
+
+    def __str__(self):
+        """Return the choice and its number of votes."""
+        return f"{self.choice}: {self.votes}"
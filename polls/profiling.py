@@ -0,0 +1,179 @@
+"""Opt-in per-request profiling for staff users.
+
+When `POLLS_PROFILING` is on, a request from a staff user is profiled if
+it carries the `X-Polls-Profile` header or is picked by the
+`POLLS_PROFILING_SAMPLE_RATE` sampling. The profile and a trace of every
+SQL query are written to `POLLS_PROFILING_DIR`, named after the view,
+and `python manage.py profile_report` summarizes them.
+"""
+import cProfile
+import collections
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+PROFILE_HEADER = "HTTP_X_POLLS_PROFILE"
+
+# Python 3.12+ allows one active cProfile profiler per process and raises
+# ValueError for a second, so concurrent requests take turns
+_cprofile_lock = threading.Lock()
+
+
+class QueryRecorder:
+    """Database execute wrapper that records each query and its duration."""
+
+    def __init__(self, alias):
+        """Initialize an empty trace for the database `alias`."""
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        """Run the query and record how long it took."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "db": self.alias,
+                "sql": sql,
+                "duration": time.perf_counter() - start,
+            })
+
+
+class StackSampler(threading.Thread):
+    """Sample the stack of one thread at a fixed interval.
+
+    A statistical alternative to cProfile with a much lower overhead. The
+    stacks are counted in "collapsed" form (`outer;inner;leaf`), which
+    flame graph tools read directly.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        """Initialize a sampler for the thread `thread_id`."""
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Take samples until stopped."""
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the thread to finish."""
+        self.stopped.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    """Profile selected requests of staff users.
+
+    Must come after `AuthenticationMiddleware`, which provides the user.
+    When `POLLS_PROFILING` is off, Django drops the middleware entirely.
+    """
+
+    def __init__(self, get_response):
+        """Read the profiling settings.
+
+        Raises:
+            MiddlewareNotUsed: If profiling is turned off.
+        """
+        if not getattr(settings, "POLLS_PROFILING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "POLLS_PROFILING_SAMPLE_RATE", 0)
+        self.mode = getattr(settings, "POLLS_PROFILING_MODE", "cprofile")
+        self.directory = getattr(settings, "POLLS_PROFILING_DIR", "profiles")
+
+    def __call__(self, request):
+        """Handle the request, profiling it if it was selected.
+
+        While another request is being profiled with cProfile, the request
+        is served without profiling.
+        """
+        if not self.should_profile(request):
+            return self.get_response(request)
+        if self.mode == "sample":
+            return self.profile(request)
+        if not _cprofile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request)
+        finally:
+            _cprofile_lock.release()
+
+    def profile(self, request):
+        """Handle the request under the profiler and save the results."""
+        recorders = [QueryRecorder(alias) for alias in connections]
+        sampler = profiler = None
+        with contextlib.ExitStack() as stack:
+            for recorder in recorders:
+                stack.enter_context(
+                    connections[recorder.alias].execute_wrapper(recorder))
+            start = time.perf_counter()
+            if self.mode == "sample":
+                sampler = StackSampler(threading.get_ident())
+                sampler.start()
+            else:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # a profiler outside this middleware is already active
+                    profiler = None
+            try:
+                response = self.get_response(request)
+            finally:
+                if sampler is not None:
+                    sampler.stop()
+                elif profiler is not None:
+                    profiler.disable()
+            elapsed = time.perf_counter() - start
+        queries = [query for recorder in recorders
+                   for query in recorder.queries]
+        self.save(request, elapsed, queries, profiler, sampler)
+        return response
+
+    def should_profile(self, request):
+        """Return True if this request should be profiled."""
+        if PROFILE_HEADER not in request.META and not (
+                self.sample_rate and random.random() < self.sample_rate):
+            return False
+        user = getattr(request, "user", None)
+        return bool(user and user.is_staff)
+
+    def save(self, request, elapsed, queries, profiler, sampler):
+        """Write the profile and SQL trace of a request to disk."""
+        match = request.resolver_match
+        view = match.view_name.replace(":", ".") if match else "unresolved"
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory,
+            f"{view}-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-"
+            f"{threading.get_ident()}")
+        if profiler is not None:
+            profiler.dump_stats(base + ".prof")
+        if sampler is not None:
+            with open(base + ".stacks", "w", encoding="utf-8") as file:
+                for stack, count in sampler.stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+        with open(base + ".sql.json", "w", encoding="utf-8") as file:
+            json.dump({"view": view, "path": request.path,
+                       "elapsed": elapsed, "queries": queries}, file)
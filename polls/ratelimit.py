@@ -0,0 +1,277 @@
+"""In-process sliding-window rate limiting for the polls app.
+
+Limits are checked before the expensive work runs (password hashing for
+logins, question and choice lookups for votes), so an abusive burst costs
+only a dictionary lookup per request. Window state is per process; each
+server worker enforces its own window.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+# counters exposed for monitoring, see get_stats()
+stats = collections.Counter()
+
+
+class SlidingWindow:
+    """Count hits per key over the last `window` seconds.
+
+    Each key keeps a deque of hit timestamps, trimmed on access, so a key
+    never holds more than `limit` timestamps. Expired keys are swept once
+    the number of tracked keys reaches `max_keys`. If every tracked key is
+    still live, a window that fails open forgets the oldest ones; one that
+    fails closed (`fail_closed`) keeps them and treats every new key as
+    over its limit until keys expire, so flooding the window with junk
+    keys cannot reset the count of another key.
+    """
+
+    def __init__(self, limit, window, max_keys=10000, clock=time.monotonic,
+                 fail_closed=False):
+        """Initialize a window allowing `limit` hits per `window` seconds."""
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self.fail_closed = fail_closed
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    def is_limited(self, key):
+        """Return True if `key` has used up its hits in the window."""
+        with self.lock:
+            now = self.clock()
+            timestamps = self.hits.get(key)
+            if not timestamps:
+                return self.fail_closed and self._full(now)
+            self._trim(timestamps, now)
+            return len(timestamps) >= self.limit
+
+    def hit(self, key):
+        """Record a hit for `key`.
+
+        Returns:
+            bool: True if the hit pushed `key` over its limit.
+        """
+        now = self.clock()
+        with self.lock:
+            timestamps = self.hits.get(key)
+            if timestamps is None:
+                if self._full(now):
+                    if self.fail_closed:
+                        return True
+                    while len(self.hits) >= self.max_keys:
+                        del self.hits[next(iter(self.hits))]
+                timestamps = self.hits[key] = collections.deque(
+                    maxlen=self.limit)
+            self._trim(timestamps, now)
+            timestamps.append(now)
+            return len(timestamps) >= self.limit
+
+    def reset(self, key):
+        """Forget every hit recorded for `key`."""
+        with self.lock:
+            self.hits.pop(key, None)
+
+    def __len__(self):
+        """Return the number of keys being tracked."""
+        return len(self.hits)
+
+    def _trim(self, timestamps, now):
+        """Drop timestamps older than the window. Caller holds the lock."""
+        while timestamps and timestamps[0] <= now - self.window:
+            timestamps.popleft()
+
+    def _full(self, now):
+        """Return True if no new key fits. Caller holds the lock.
+
+        Expired keys are swept first.
+        """
+        if len(self.hits) < self.max_keys:
+            return False
+        for key in [key for key, timestamps in self.hits.items()
+                    if not timestamps or timestamps[-1] <= now - self.window]:
+            del self.hits[key]
+        return len(self.hits) >= self.max_keys
+
+
+_login_windows = None
+_vote_window = None
+_guest_ip_window = None
+
+
+def client_ip(request):
+    """Return the client IP address to rate limit on.
+
+    `X-Forwarded-For` is written by the client as much as by proxies, so
+    only the last `TRUSTED_PROXY_COUNT` addresses in it, the ones added by
+    the site's own proxies, are trusted. With no trusted proxy (the
+    default) the address of the connection is used.
+    """
+    proxies = getattr(settings, "TRUSTED_PROXY_COUNT", 0)
+    if proxies:
+        forwarded = [address.strip() for address in request.META.get(
+            "HTTP_X_FORWARDED_FOR", "").split(",") if address.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get("REMOTE_ADDR")
+
+
+def get_login_windows():
+    """Return the (per-IP, per-username) windows for failed logins."""
+    global _login_windows
+    if _login_windows is None:
+        window = getattr(settings, "LOGIN_RATE_WINDOW", 300)
+        # fail closed: evicting live keys would reset a victim's count
+        _login_windows = (
+            SlidingWindow(getattr(settings, "LOGIN_RATE_LIMIT_IP", 20),
+                          window, fail_closed=True),
+            SlidingWindow(getattr(settings, "LOGIN_RATE_LIMIT_USER", 5),
+                          window, fail_closed=True),
+        )
+    return _login_windows
+
+
+def login_limited(ip, username):
+    """Return True if logins from `ip` or for `username` are over the limit.
+
+    Unlike `login_blocked()`, does not count a blocked attempt.
+    """
+    if not getattr(settings, "LOGIN_RATE_LIMIT_ENABLED", True):
+        return False
+    by_ip, by_user = get_login_windows()
+    return by_ip.is_limited(ip) or bool(
+        username and by_user.is_limited(username))
+
+
+def login_blocked(ip, username):
+    """Return True if logins from `ip` or for `username` are blocked."""
+    if login_limited(ip, username):
+        stats["login_blocked"] += 1
+        return True
+    return False
+
+
+def record_login_failure(ip, username):
+    """Count a failed login against both the IP and the username."""
+    by_ip, by_user = get_login_windows()
+    stats["login_failures"] += 1
+    by_ip.hit(ip)
+    if username:
+        by_user.hit(username)
+
+
+def reset_login_failures(username):
+    """Clear the failed-login count of `username` after a good login."""
+    get_login_windows()[1].reset(username)
+
+
+def get_vote_window():
+    """Return the window counting votes per user and question."""
+    global _vote_window
+    if _vote_window is None:
+        _vote_window = SlidingWindow(
+            getattr(settings, "VOTE_RATE_LIMIT", 10),
+            getattr(settings, "VOTE_RATE_WINDOW", 60),
+        )
+    return _vote_window
+
+
+def vote_throttled(user_id, question_id):
+    """Count a vote attempt and return True if it is over the limit."""
+    window = get_vote_window()
+    key = (user_id, question_id)
+    if window.is_limited(key):
+        stats["vote_throttled"] += 1
+        return True
+    window.hit(key)
+    return False
+
+
+def get_guest_ip_window():
+    """Return the window counting guest votes per IP and question."""
+    global _guest_ip_window
+    if _guest_ip_window is None:
+        _guest_ip_window = SlidingWindow(
+            getattr(settings, "GUEST_VOTE_RATE_LIMIT_IP", 30),
+            getattr(settings, "VOTE_RATE_WINDOW", 60),
+        )
+    return _guest_ip_window
+
+
+def guest_ip_throttled(ip, question_id):
+    """Count a guest vote from `ip` and return True if over the limit.
+
+    Device tokens are free to obtain, so guests are also limited by IP.
+    """
+    window = get_guest_ip_window()
+    key = (ip, question_id)
+    if window.is_limited(key):
+        stats["guest_ip_throttled"] += 1
+        return True
+    window.hit(key)
+    return False
+
+
+def _vote_cache_key(user_id, question_id):
+    """Return the cache key remembering a user's last vote on a question."""
+    return f"polls:vote:{user_id}:{question_id}"
+
+
+def claim_vote(user_id, question_id, choice_id):
+    """Claim a vote before recording it, or detect a duplicate submit.
+
+    A vote is a duplicate when the same user picked the same choice on the
+    same question within `VOTE_IDEMPOTENCY_WINDOW` seconds. The claim is
+    taken with `cache.add()` before the vote is written, so of two
+    submits of a double-click sent at the same time only one goes on.
+
+    Returns:
+        bool: True if the vote is a duplicate and must not be recorded.
+    """
+    timeout = getattr(settings, "VOTE_IDEMPOTENCY_WINDOW", 5)
+    if not choice_id or not timeout:
+        return False
+    key = _vote_cache_key(user_id, question_id)
+    if cache.add(key, choice_id, timeout):
+        metrics.cache_lookup("vote_idempotency", False)
+        return False
+    previous = cache.get(key)
+    metrics.cache_lookup("vote_idempotency", previous is not None)
+    if previous is not None and str(previous) == str(choice_id):
+        stats["vote_coalesced"] += 1
+        return True
+    # a different choice: this vote replaces the claim
+    cache.set(key, choice_id, timeout)
+    return False
+
+
+def release_vote(user_id, question_id):
+    """Drop the claim of a vote that was refused, so it can be retried."""
+    cache.delete(_vote_cache_key(user_id, question_id))
+
+
+def get_stats():
+    """Return the rate limiting counters and the number of tracked keys."""
+    by_ip, by_user = get_login_windows()
+    return dict(stats, login_tracked_ips=len(by_ip),
+                login_tracked_users=len(by_user),
+                vote_tracked_keys=len(get_vote_window()))
+
+
+@receiver(setting_changed)
+def reset_windows(setting, **kwargs):
+    """Rebuild the windows when rate limit settings change (for tests)."""
+    global _login_windows, _vote_window, _guest_ip_window
+    if setting.startswith("LOGIN_RATE_"):
+        _login_windows = None
+    if setting.startswith("VOTE_RATE_"):
+        _vote_window = None
+    if setting in ("GUEST_VOTE_RATE_LIMIT_IP", "VOTE_RATE_WINDOW"):
+        _guest_ip_window = None
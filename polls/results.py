@@ -0,0 +1,165 @@
+"""Maintain the precomputed `QuestionResult` tables.
+
+The vote path updates the totals incrementally with single-row `UPDATE`s,
+so showing results never has to count `Vote` rows. `refresh_results()`
+rebuilds a question's totals from the raw votes, and `check_results()`
+reports where the two disagree.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import routers
+from .models import Choice, ChoiceResult, GuestVote, QuestionResult, Vote
+
+
+def count_votes(question):
+    """Count the raw `Vote` and `GuestVote` rows of a question.
+
+    Returns:
+        tuple: (dict mapping choice id to votes, number of voters).
+    """
+    votes = Vote.objects.filter(question=question)
+    guest_votes = GuestVote.objects.filter(question=question)
+    per_choice = dict(
+        votes.values("choice").annotate(total=Count("id"))
+        .values_list("choice", "total")
+    )
+    for choice_id, total in guest_votes.values("choice") \
+            .annotate(total=Count("id")).values_list("choice", "total"):
+        per_choice[choice_id] = per_choice.get(choice_id, 0) + total
+    # a device votes at most once per question
+    voters = votes.values("user").distinct().count() + guest_votes.count()
+    return per_choice, voters
+
+
+@transaction.atomic
+def refresh_results(question):
+    """Rebuild the results of a question from its votes.
+
+    The votes are always counted on the primary: the results page reads
+    from the replica, and totals counted there could miss recent votes
+    and would then be stored over the primary's.
+
+    Returns:
+        QuestionResult: The refreshed results.
+    """
+    with routers.primary_reads():
+        per_choice, voters = count_votes(question)
+        result, _ = QuestionResult.objects.update_or_create(
+            question=question,
+            defaults={"voter_count": voters, "updated_at": timezone.now()},
+        )
+        for choice in question.choice_set.all():
+            ChoiceResult.objects.update_or_create(
+                choice=choice,
+                defaults={"result": result,
+                          "votes": per_choice.get(choice.id, 0)},
+            )
+    return result
+
+
+def freeze_results(question):
+    """Record the final results of a closed question.
+
+    Returns:
+        QuestionResult: The frozen results.
+    """
+    result = refresh_results(question)
+    result.frozen_at = timezone.now()
+    result.save(update_fields=["frozen_at"])
+    return result
+
+
+def get_results(question):
+    """Return the results of a question, building them on first use."""
+    try:
+        return question.result
+    except QuestionResult.DoesNotExist:
+        if question.end_date is not None \
+                and question.end_date <= timezone.now():
+            return freeze_results(question)
+        return refresh_results(question)
+
+
+@transaction.atomic(savepoint=False)
+def record_vote(question, choice, previous_choice_id=None):
+    """Apply one vote to the results of its question.
+
+    Must be called after the vote has been saved.
+
+    Args:
+        question (Question): The question voted on.
+        choice (Choice): The choice voted for.
+        previous_choice_id (int): The choice the user voted for before,
+                                  or None for a first vote.
+    """
+    if previous_choice_id == choice.id:
+        return
+    updated = QuestionResult.objects.filter(question=question).update(
+        voter_count=F("voter_count") + int(previous_choice_id is None),
+        updated_at=timezone.now(),
+    )
+    # no results yet, or a choice without a total: rebuild from the votes
+    if not updated or not ChoiceResult.objects.filter(
+            choice=choice).update(votes=F("votes") + 1):
+        refresh_results(question)
+        return
+    if previous_choice_id is not None:
+        ChoiceResult.objects.filter(choice_id=previous_choice_id).update(
+            votes=F("votes") - 1)
+
+
+def check_results(question):
+    """Compare the results of a question with its raw votes.
+
+    Returns:
+        list: Human-readable descriptions of every mismatch, empty if the
+              results are consistent or were never built.
+    """
+    result = QuestionResult.objects.filter(question=question).first()
+    if result is None:
+        return []
+    per_choice, voters = count_votes(question)
+    problems = []
+    if result.voter_count != voters:
+        problems.append(
+            f"voter count is {result.voter_count}, votes say {voters}")
+    stored = dict(result.choices.values_list("choice", "votes"))
+    for choice in question.choice_set.all():
+        expected = per_choice.get(choice.id, 0)
+        if choice.id not in stored:
+            problems.append(f"choice {choice.id} has no total")
+        elif stored[choice.id] != expected:
+            problems.append(
+                f"choice {choice.id} total is {stored[choice.id]}, "
+                f"votes say {expected}")
+    return problems
+
+
+@receiver(post_save, sender=Choice)
+def add_choice_total(sender, instance, created, raw=False, **kwargs):
+    """Give a new choice a zero total if its question has results.
+
+    Fixtures loaded with `loaddata` (`raw`) bring their own totals.
+    """
+    if raw:
+        return
+    if created:
+        result = QuestionResult.objects.filter(
+            question_id=instance.question_id).first()
+        if result is not None:
+            ChoiceResult.objects.get_or_create(
+                choice=instance, defaults={"result": result})
+
+
+@receiver(post_delete, sender=Vote)
+@receiver(post_delete, sender=GuestVote)
+def remove_vote(sender, instance, **kwargs):
+    """Take a deleted vote out of the totals."""
+    ChoiceResult.objects.filter(choice_id=instance.choice_id).update(
+        votes=F("votes") - 1)
+    QuestionResult.objects.filter(question_id=instance.question_id).update(
+        voter_count=F("voter_count") - 1, updated_at=timezone.now())
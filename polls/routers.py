@@ -0,0 +1,121 @@
+"""Database routing that sends poll browsing reads to a read replica.
+
+Views that only display polls set `read_from_replica = True`. For those
+requests `ReplicaRoutingMiddleware` turns on replica reads, and the router
+then sends reads of polls models to the `DATABASE_REPLICA_ALIAS` database.
+Everything else (writes, sessions, users, the vote and signup views) uses
+the primary `default` database.
+
+After a user votes, the vote view sets a short-lived cookie that keeps
+that user's reads on the primary, so the results page they are redirected
+to always shows their own vote (read-your-writes).
+"""
+import contextlib
+import contextvars
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.dispatch import receiver
+
+# cookie that pins a client's reads to the primary after a write
+PIN_COOKIE = "polls_primary"
+
+_replica_reads = contextvars.ContextVar("polls_replica_reads", default=False)
+
+
+def replica_alias():
+    """Return the replica alias, or None if no replica is configured."""
+    alias = getattr(settings, "DATABASE_REPLICA_ALIAS", None)
+    if alias and alias in settings.DATABASES:
+        return alias
+    return None
+
+
+def set_replica_reads(enabled):
+    """Turn replica reads on or off for the current request."""
+    _replica_reads.set(enabled)
+
+
+def replica_reads_enabled():
+    """Return True if the current request may read from the replica."""
+    return _replica_reads.get()
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Read from the primary inside the block, even in a replica view.
+
+    For reads whose results are written back, such as rebuilding totals,
+    which must never copy a lagging replica over the primary.
+    """
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary(response):
+    """Keep the client's reads on the primary for `REPLICA_STICKY_SECONDS`."""
+    seconds = getattr(settings, "REPLICA_STICKY_SECONDS", 10)
+    if seconds and replica_alias():
+        response.set_cookie(PIN_COOKIE, "1", max_age=seconds, httponly=True,
+                            samesite="Lax")
+    return response
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def reset_replica_reads(**kwargs):
+    """Forget the replica flag between requests.
+
+    Reset on `request_finished` rather than when the middleware returns,
+    so a streaming response still reads from the replica while it is
+    being sent.
+    """
+    _replica_reads.set(False)
+
+
+class PrimaryReplicaRouter:
+    """Route polls reads to the replica when the request allows it."""
+
+    def db_for_read(self, model, **hints):
+        """Return the replica for polls models during replica reads."""
+        if model._meta.app_label == "polls" and replica_reads_enabled():
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        """Send every write to the primary."""
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations: the replica holds the same data as the primary."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Only migrate the primary; the replica copies its schema."""
+        return db != replica_alias()
+
+
+class ReplicaRoutingMiddleware:
+    """Enable replica reads for read-only views of unpinned clients."""
+
+    def __init__(self, get_response):
+        """Initialize the middleware."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Handle the request."""
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Enable replica reads if the view allows it."""
+        view_class = getattr(view_func, "view_class", view_func)
+        if not getattr(view_class, "read_from_replica", False):
+            return None
+        pinned = PIN_COOKIE in request.COOKIES
+        if request.method in ("GET", "HEAD") and not pinned \
+                and replica_alias():
+            set_replica_reads(True)
+        return None
@@ -0,0 +1,51 @@
+"""Static files storage that fingerprints and precompresses assets."""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always produced
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes `.gz` and `.br` copies.
+
+    `collectstatic` stores every asset under a content-hashed name (e.g.
+    `style.4f2a1c.css`) so it can be cached forever, then writes gzip and,
+    when the `brotli` package is installed, brotli versions of text assets
+    next to it. The compressed copy is kept only when it is smaller.
+    """
+
+    compress_extensions = (".css", ".js", ".svg", ".html", ".txt", ".json",
+                           ".xml", ".map")
+
+    def post_process(self, paths, dry_run=False, **options):
+        """Hash the files as usual, then compress the hashed copies."""
+        hashed_names = {}
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names[hashed_name] = True
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in hashed_names:
+            if hashed_name.endswith(self.compress_extensions):
+                self.compress(self.path(hashed_name))
+
+    def compress(self, path):
+        """Write the compressed copies of the file at `path`."""
+        with open(path, "rb") as file:
+            content = file.read()
+        variants = [(".gz", gzip.compress(content, 9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(content)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(content):
+                with open(path + suffix, "wb") as file:
+                    file.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -0,0 +1,52 @@
+"""Template tags that memoize static and URL lookups for the polls pages.
+
+The static URL of an asset and the URL of a view without arguments never
+change while the server runs, so they are computed once per process
+instead of on every render.
+"""
+from functools import lru_cache
+
+from django import template
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.templatetags.static import static
+from django.urls import get_script_prefix, reverse
+
+register = template.Library()
+
+
+@lru_cache(maxsize=256)
+def _static_url(path):
+    """Return the URL of a static asset."""
+    return static(path)
+
+
+@lru_cache(maxsize=256)
+def _view_url(name, script_prefix):
+    """Return the URL of a view that takes no arguments."""
+    return reverse(name)
+
+
+@register.simple_tag
+def cached_static(path):
+    """Like `{% static %}`, computed once per path."""
+    return _static_url(path)
+
+
+@register.simple_tag
+def cached_url(name):
+    """Like `{% url %}` for views without arguments, computed once."""
+    return _view_url(name, get_script_prefix())
+
+
+def clear_caches():
+    """Forget every memoized URL."""
+    _static_url.cache_clear()
+    _view_url.cache_clear()
+
+
+@receiver(setting_changed)
+def clear_caches_on_setting_change(setting, **kwargs):
+    """Forget memoized URLs when the settings they depend on change."""
+    if setting in ("STATIC_URL", "STORAGES", "ROOT_URLCONF"):
+        clear_caches()
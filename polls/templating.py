@@ -0,0 +1,41 @@
+"""Helpers for loading the polls templates ahead of the first request."""
+import logging
+from pathlib import Path
+
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+
+logger = logging.getLogger('polls')
+
+TEMPLATE_DIRS = [
+    Path(__file__).resolve().parent / "templates",
+    Path(__file__).resolve().parent.parent / "templates",
+]
+
+
+def template_names():
+    """Return the names of every template used by the polls site."""
+    names = []
+    for directory in TEMPLATE_DIRS:
+        names.extend(sorted(
+            path.relative_to(directory).as_posix()
+            for path in directory.rglob("*.html")
+        ))
+    return names
+
+
+def warm_templates():
+    """Compile every polls template so the cached loader holds them.
+
+    Returns:
+        int: Number of templates loaded.
+    """
+    loaded = 0
+    for name in template_names():
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            logger.warning(f'Template {name} could not be warmed.')
+            continue
+        loaded += 1
+    return loaded
@@ -1,14 +1,38 @@
 """Unit tod for the polls app."""
 import datetime
+import gzip
+import heapq
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
 import django.test
 
+from django.contrib.auth.hashers import get_hasher, make_password
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connection, IntegrityError, models
 from mysite import settings
 from django.utils import timezone
-from django.test import TestCase
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 
-from .models import Question, Choice
+from . import events, guests, importer, lifecycle, metrics, profiling, \
+    ratelimit, results, routers, templating
+from .templatetags import polls_extras
+from .models import Question, Choice, GuestVote, PollEvent, QuestionResult, \
+    Vote
 
 
 class QuestionModelTests(TestCase):
@@ -162,18 +186,18 @@ class QuestionDetailViewTests(TestCase):
 class UserAuthTest(django.test.TestCase):
     """Tests for user authentication."""
 
-    def setUp(self):
-        """Superclass setup creates Client obj & initializes test database."""
-        super().setUp()
-        self.username = "testuser"
-        self.password = "FatChance!"
-        self.user1 = User.objects.create_user(
-            username=self.username,
-            password=self.password,
+    @classmethod
+    def setUpTestData(cls):
+        """Create the user and poll once for every test in the class."""
+        cls.username = "testuser"
+        cls.password = "FatChance!"
+        cls.user1 = User.objects.create_user(
+            username=cls.username,
+            password=cls.password,
             email="testuser@nowhere.com"
         )
-        self.user1.first_name = "Tester"
-        self.user1.save()
+        cls.user1.first_name = "Tester"
+        cls.user1.save()
         # we need a poll question to test voting
         q = Question.objects.create(question_text="First Poll Question")
         q.save()
@@ -181,7 +205,13 @@ class UserAuthTest(django.test.TestCase):
         for n in range(1, 4):
             choice = Choice(choice_text=f"Choice {n}", question=q)
             choice.save()
-        self.question = q
+        cls.question = q
+
+    def setUp(self):
+        """Forget votes remembered by other tests."""
+        super().setUp()
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
 
     def test_logout(self):
         """A user can logout using the logout url.
@@ -271,44 +301,1370 @@ class UserAuthTest(django.test.TestCase):
         self.assertContains(response,
                             "Please enter a correct username and password.")
 
+    def test_voting_with_authentication(self):
+        """An authenticated user can submit a vote."""
+        vote_url = reverse('polls:vote', args=[self.question.id])
+        choice = self.question.choice_set.first()
+        form_data = {"choice": f"{choice.id}"}
+
+        # Login the user
+        self.client.login(username=self.username, password=self.password)
+
+        # Submit a vote
+        response = self.client.post(vote_url, form_data)
+
+        # Check that the vote was recorded
+        self.assertRedirects(response,
+                             reverse('polls:results', args=[self.question.id]))
+        self.assertEqual(choice.votes, 1)
+
+    def test_changing_vote(self):
+        """An authenticated user can change their vote during the voting period."""
+        vote_url = reverse('polls:vote', args=[self.question.id])
+        choice1 = self.question.choice_set.first()
+        choice2 = self.question.choice_set.last()
+        form_data = {"choice": f"{choice1.id}"}
+
+        # Login the user
+        self.client.login(username=self.username, password=self.password)
+
+        # Submit an initial vote
+        self.client.post(vote_url, form_data)
+
+        # Change the vote
+        form_data = {"choice": f"{choice2.id}"}
+        response = self.client.post(vote_url, form_data)
+
+        # Check that the vote was updated
+        self.assertRedirects(response,
+                             reverse('polls:results', args=[self.question.id]))
+        self.assertEqual(choice1.votes, 0)
+        self.assertEqual(choice2.votes, 1)
+
+
+class EventStreamTests(TestCase):
+    """Tests for the structured event stream."""
+
+    def test_buffer_is_bounded(self):
+        """The ring buffer keeps at most `capacity` events."""
+        buffer = events.EventBuffer(events.NullSink(), capacity=3,
+                                    batch_size=100)
+        for n in range(5):
+            buffer.record(events.VOTE_CAST, question_id=n)
+        self.assertEqual(len(buffer.events), 3)
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.events[0]["question_id"], 2)
+
+    def test_buffer_flushes_in_batches(self):
+        """Events are written to the sink once a batch is full."""
+        written = []
+
+        class ListSink(events.NullSink):
+            def write(self, batch):
+                written.append(batch)
+
+        buffer = events.EventBuffer(ListSink(), batch_size=2)
+        buffer.record(events.LOGIN, username="a")
+        self.assertEqual(written, [])
+        buffer.record(events.LOGIN, username="b")
+        self.assertEqual(len(written), 1)
+        self.assertEqual(len(written[0]), 2)
+        self.assertEqual(len(buffer.events), 0)
+
+    def test_flusher_writes_full_batches(self):
+        """A full batch is written by the flusher thread, not the caller."""
+        writers = []
+        written = threading.Event()
+
+        class ThreadSink(events.NullSink):
+            def write(self, batch):
+                writers.append(threading.get_ident())
+                written.set()
+
+        buffer = events.EventBuffer(ThreadSink(), batch_size=2,
+                                    flush_interval=60)
+        buffer.record(events.LOGIN, username="a")
+        buffer.record(events.LOGIN, username="b")
+        self.assertTrue(written.wait(5))
+        buffer.close()
+        self.assertNotIn(threading.get_ident(), writers)
+        self.assertIsNone(buffer.flusher)
+
+    def test_flusher_writes_partial_batches(self):
+        """Events of a quiet process are written after the interval."""
+        written = threading.Event()
+
+        class ListSink(events.NullSink):
+            def write(self, batch):
+                written.set()
+
+        buffer = events.EventBuffer(ListSink(), batch_size=100,
+                                    flush_interval=0.01)
+        buffer.record(events.LOGIN, username="a")
+        self.assertTrue(written.wait(5))
+        buffer.close()
+        self.assertEqual(len(buffer.events), 0)
+
+    def test_sink_failure_is_logged(self):
+        """A sink that fails drops the batch instead of raising."""
+        class BrokenSink(events.NullSink):
+            def write(self, batch):
+                raise OSError("disk full")
+
+        buffer = events.EventBuffer(BrokenSink(), batch_size=1)
+        with self.assertLogs("polls", level="ERROR"):
+            buffer.record(events.LOGIN, username="a")
+        self.assertEqual(buffer.dropped, 1)
+
+    def test_jsonl_sink_round_trip(self):
+        """Events written to a JSONL file can be read back."""
+        with tempfile.TemporaryDirectory() as directory:
+            sink = events.JsonlSink(os.path.join(directory, "events.jsonl"))
+            sink.write([{"type": events.LOGIN, "timestamp": "t"}])
+            sink.write([{"type": events.LOGOUT, "timestamp": "t"}])
+            self.assertEqual(
+                [event["type"] for event in sink.read()],
+                [events.LOGIN, events.LOGOUT])
+
+    @override_settings(POLLS_EVENT_SINK="db", POLLS_EVENT_BATCH_SIZE=1,
+                       POLLS_EVENT_FLUSH_INTERVAL=0)
+    def test_vote_records_events(self):
+        """Casting and changing a vote are recorded as typed events."""
+        cache.clear()
+        user = User.objects.create_user(username="voter", password="pw")
+        question = create_question("Event question", days=-1)
+        choice1 = question.choice_set.create(choice_text="One")
+        choice2 = question.choice_set.create(choice_text="Two")
+        self.client.force_login(user)
+        vote_url = reverse("polls:vote", args=[question.id])
+        self.client.post(vote_url, {"choice": choice1.id})
+        self.client.post(vote_url, {"choice": choice2.id})
+        self.assertEqual(
+            list(PollEvent.objects.filter(
+                question_id=question.id).order_by("id").values_list(
+                "event_type", "choice_id")),
+            [(events.VOTE_CAST, choice1.id),
+             (events.VOTE_CHANGED, choice2.id)])
+
+    def test_aggregate_by_minute(self):
+        """Events are counted per minute and per type."""
+        stream = [
+            {"type": events.VOTE_CAST, "timestamp": "2024-09-08T07:49:01"},
+            {"type": events.VOTE_CAST, "timestamp": "2024-09-08T07:49:59"},
+            {"type": events.LOGIN, "timestamp": "2024-09-08T07:50:00"},
+        ]
+        buckets = events.aggregate_by_minute(stream)
+        self.assertEqual(buckets["2024-09-08T07:49"][events.VOTE_CAST], 2)
+        self.assertEqual(buckets["2024-09-08T07:50"][events.LOGIN], 1)
+
+
+class SlidingWindowTests(TestCase):
+    """Tests for the sliding-window rate limiter."""
+
+    def setUp(self):
+        """Create a window driven by a fake clock."""
+        self.now = 0
+        self.window = ratelimit.SlidingWindow(
+            limit=3, window=10, max_keys=2, clock=lambda: self.now)
+
+    def test_limit_within_window(self):
+        """A key is limited after `limit` hits inside the window."""
+        for _ in range(2):
+            self.window.hit("key")
+        self.assertFalse(self.window.is_limited("key"))
+        self.window.hit("key")
+        self.assertTrue(self.window.is_limited("key"))
+
+    def test_hits_expire(self):
+        """Hits older than the window no longer count."""
+        for _ in range(3):
+            self.window.hit("key")
+        self.now = 11
+        self.assertFalse(self.window.is_limited("key"))
+
+    def test_tracked_keys_are_bounded(self):
+        """The window never tracks more than `max_keys` keys."""
+        for key in ("a", "b", "c", "d"):
+            self.window.hit(key)
+        self.assertLessEqual(len(self.window), 2)
+
+    def test_fail_closed_keeps_live_keys(self):
+        """A full fail-closed window limits new keys instead of evicting."""
+        window = ratelimit.SlidingWindow(limit=3, window=10, max_keys=2,
+                                         clock=lambda: self.now,
+                                         fail_closed=True)
+        for _ in range(2):
+            window.hit("victim")
+        window.hit("junk")
+        self.assertTrue(window.hit("more junk"))
+        self.assertTrue(window.is_limited("other"))
+        window.hit("victim")
+        self.assertTrue(window.is_limited("victim"))
+        self.now = 11
+        self.assertFalse(window.is_limited("other"))
+
+
+@override_settings(LOGIN_RATE_LIMIT_USER=3, LOGIN_RATE_LIMIT_IP=100)
+class LoginRateLimitTests(TestCase):
+    """Tests for rejecting abusive login attempts."""
+
+    def setUp(self):
+        """Create a user to attack and start with empty windows."""
+        for window in ratelimit.get_login_windows():
+            window.hits.clear()
+        self.user = User.objects.create_user(username="target",
+                                             password="Correct!Horse")
+        self.login_url = reverse("login")
+
+    def test_blocks_after_repeated_failures(self):
+        """Once the limit is hit even the right password is refused."""
+        for _ in range(3):
+            response = self.client.post(
+                self.login_url, {"username": "target", "password": "wrong"})
+            self.assertEqual(response.status_code, 200)
+        with mock.patch(
+                "django.contrib.auth.forms.authenticate") as authenticate:
+            response = self.client.post(
+                self.login_url,
+                {"username": "target", "password": "Correct!Horse"})
+            authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("login_blocked", ratelimit.get_stats())
+
+    def test_blocked_attempts_do_not_extend_the_block(self):
+        """Refused attempts are not counted as new failures."""
+        for _ in range(3):
+            self.client.post(
+                self.login_url, {"username": "target", "password": "wrong"})
+        by_ip, by_user = ratelimit.get_login_windows()
+        hits = list(by_user.hits["target"])
+        self.client.post(reverse("admin:login"),
+                         {"username": "target", "password": "Correct!Horse"})
+        self.assertEqual(list(by_user.hits["target"]), hits)
+
+    def test_forged_forwarded_for_does_not_reset_ip_limit(self):
+        """Failures count against the connection's address."""
+        with self.settings(LOGIN_RATE_LIMIT_IP=3):
+            for number in range(3):
+                self.client.post(
+                    self.login_url,
+                    {"username": f"user{number}", "password": "wrong"},
+                    HTTP_X_FORWARDED_FOR=f"10.0.0.{number}")
+            self.assertTrue(ratelimit.login_blocked("127.0.0.1", "someone"))
+
+    def test_admin_login_is_blocked(self):
+        """The admin login page enforces the same limit."""
+        self.user.is_staff = True
+        self.user.save()
+        admin_login = reverse("admin:login")
+        for _ in range(3):
+            self.client.post(
+                admin_login, {"username": "target", "password": "wrong"})
+        response = self.client.post(
+            admin_login, {"username": "target", "password": "Correct!Horse"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+    def test_success_resets_username_failures(self):
+        """A successful login clears the failures of that username."""
+        for _ in range(2):
+            self.client.post(
+                self.login_url, {"username": "target", "password": "wrong"})
+        response = self.client.post(
+            self.login_url,
+            {"username": "target", "password": "Correct!Horse"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ratelimit.login_blocked("127.0.0.1", "target"))
+
+
+@override_settings(VOTE_RATE_LIMIT=3, VOTE_IDEMPOTENCY_WINDOW=5)
+class VoteThrottleTests(TestCase):
+    """Tests for vote throttling and duplicate-submit coalescing."""
+
+    def setUp(self):
+        """Log in a voter and create a question with two choices."""
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+        self.user = User.objects.create_user(username="clicker",
+                                             password="pw")
+        self.client.force_login(self.user)
+        self.question = create_question("Throttle question", days=-1)
+        self.choice1 = self.question.choice_set.create(choice_text="One")
+        self.choice2 = self.question.choice_set.create(choice_text="Two")
+        self.vote_url = reverse("polls:vote", args=[self.question.id])
+        self.results_url = reverse("polls:results", args=[self.question.id])
+
+    def test_duplicate_vote_is_coalesced(self):
+        """A repeated identical vote redirects without any polls query."""
+        self.client.post(self.vote_url, {"choice": self.choice1.id})
+        coalesced = ratelimit.stats["vote_coalesced"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.vote_url,
+                                        {"choice": self.choice1.id})
+        self.assertFalse(
+            [query for query in queries if "polls_" in query["sql"]])
+        self.assertRedirects(response, self.results_url,
+                             fetch_redirect_response=False)
+        self.assertEqual(ratelimit.stats["vote_coalesced"], coalesced + 1)
+
+    def test_concurrent_duplicate_is_coalesced(self):
+        """The second of two simultaneous submits sees the first's claim."""
+        self.assertFalse(ratelimit.claim_vote(self.user.id, self.question.id,
+                                              str(self.choice1.id)))
+        # the first submit has not written its vote yet
+        response = self.client.post(self.vote_url,
+                                    {"choice": self.choice1.id})
+        self.assertRedirects(response, self.results_url,
+                             fetch_redirect_response=False)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_refused_vote_can_be_retried(self):
+        """A vote refused for a bad choice does not keep its claim."""
+        self.client.post(self.vote_url, {"choice": 0})
+        self.assertFalse(ratelimit.claim_vote(self.user.id, self.question.id,
+                                              "0"))
+
+    def test_changed_vote_is_not_coalesced(self):
+        """Picking a different choice is still recorded."""
+        self.client.post(self.vote_url, {"choice": self.choice1.id})
+        self.client.post(self.vote_url, {"choice": self.choice2.id})
+        self.assertEqual(self.choice1.votes, 0)
+        self.assertEqual(self.choice2.votes, 1)
+
+    def test_too_many_votes_are_rejected(self):
+        """Votes over the limit are refused with 429."""
+        for n in range(3):
+            choice = (self.choice1, self.choice2)[n % 2]
+            response = self.client.post(self.vote_url,
+                                        {"choice": choice.id})
+            self.assertEqual(response.status_code, 302)
+        response = self.client.post(self.vote_url,
+                                    {"choice": self.choice2.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(ratelimit.stats["vote_throttled"], 1)
+
+
+def count_writes(queries):
+    """Return the number of INSERT, UPDATE and DELETE statements."""
+    return sum(1 for query in queries
+               if query["sql"].split()[0] in ("INSERT", "UPDATE", "DELETE"))
+
+
+@override_settings(VOTE_IDEMPOTENCY_WINDOW=0)
+class SessionStorageTests(TestCase):
+    """Tests for the session and message storage modes."""
+
+    def setUp(self):
+        """Log in a voter and create a question with two choices."""
+        cache.clear()
+        self.user = User.objects.create_user(username="saver",
+                                             password="pw")
+        self.question = create_question("Storage question", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="One")
+        self.vote_url = reverse("polls:vote", args=[self.question.id])
+        results.refresh_results(self.question)
+
+    def vote_writes(self):
+        """Vote and return the DB writes of the vote and results requests."""
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.vote_url, {"choice": self.choice.id},
+                             follow=True)
+        return count_writes(queries)
+
+    def test_session_messages_write_the_session(self):
+        """Session-backed messages add django_session writes to a vote."""
+        # the vote and its two totals + 1 session save per request
+        self.assertEqual(self.vote_writes(), 5)
+
+    @override_settings(
+        MESSAGE_STORAGE="django.contrib.messages.storage.cookie."
+                        "CookieStorage",
+        SESSION_ENGINE="django.contrib.sessions.backends.cache")
+    def test_cookie_messages_and_cache_sessions_only_write_the_vote(self):
+        """With cookie messages and cached sessions only the vote writes."""
+        self.assertEqual(self.vote_writes(), 3)
+
+    def test_cleanup_sessions_deletes_expired(self):
+        """cleanup_sessions removes expired sessions in batches."""
+        past = timezone.now() - datetime.timedelta(days=1)
+        for n in range(5):
+            Session.objects.create(session_key=f"expired{n}",
+                                   session_data="", expire_date=past)
+        self.client.force_login(self.user)
+        out = io.StringIO()
+        call_command("cleanup_sessions", batch_size=2, stdout=out)
+        self.assertIn("Deleted 5 expired sessions.", out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000,
+                   PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+class PasswordHashingTests(TestCase):
+    """Tests for the configurable password hashing policy."""
+
+    def test_login_rehashes_with_preferred_hasher(self):
+        """A password hashed by an old hasher is upgraded on login."""
+        with self.settings(PASSWORD_HASHERS=[
+                "polls.hashers.TunedPBKDF2PasswordHasher"]):
+            user = User.objects.create_user(username="old", password="pw")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+        with self.settings(PASSWORD_HASHERS=[
+                "polls.hashers.TunedScryptPasswordHasher",
+                "polls.hashers.TunedPBKDF2PasswordHasher"]):
+            self.assertTrue(
+                self.client.login(username="old", password="pw"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("scrypt$1024$"))
+
+    def test_changed_cost_triggers_rehash(self):
+        """Raising the configured cost marks stored hashes as outdated."""
+        with self.settings(PASSWORD_HASHERS=[
+                "polls.hashers.TunedPBKDF2PasswordHasher"]):
+            encoded = make_password("pw")
+            self.assertFalse(get_hasher().must_update(encoded))
+            with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+                self.assertTrue(get_hasher().must_update(encoded))
+
+
+@override_settings(PASSWORD_HASHERS=[
+    "django.contrib.auth.hashers.MD5PasswordHasher"])
+class ProvisionUsersTests(TestCase):
+    """Tests for the provision_users management command."""
+
+    def write_roster(self, text):
+        """Write a roster CSV to a temporary file and return its path."""
+        file = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+        with file:
+            file.write(text)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def test_creates_users_with_usable_passwords(self):
+        """Every roster row becomes a user who can log in."""
+        rows = "".join(f"student{n},secret{n},s{n}@ku.th\n" for n in range(6))
+        roster = self.write_roster("username,password,email\n" + rows)
+        out = io.StringIO()
+        call_command("provision_users", roster, workers=2, batch_size=4,
+                     stdout=out)
+        self.assertIn("Created 6 users", out.getvalue())
+        self.assertTrue(
+            self.client.login(username="student3", password="secret3"))
+
+    def test_invalid_roster_creates_nobody(self):
+        """A roster with errors is rejected before any user is created."""
+        roster = self.write_roster(
+            "username,password\nalice,pw\nalice,pw\nbob,\n")
+        with self.assertRaisesMessage(CommandError, "duplicate username"):
+            call_command("provision_users", roster, workers=1)
+        self.assertFalse(User.objects.exists())
+
+
+class TemplateCachingTests(TestCase):
+    """Tests for the memoized template tags and template warming."""
+
+    def setUp(self):
+        """Start from empty URL caches."""
+        polls_extras.clear_caches()
+
+    def test_cached_tags_match_builtin_tags(self):
+        """cached_static and cached_url render what static and url do."""
+        rendered = Template(
+            "{% load static polls_extras %}"
+            "{% cached_static 'polls/style.css' %} "
+            "{% static 'polls/style.css' %} "
+            "{% cached_url 'polls:index' %} {% url 'polls:index' %}"
+        ).render(Context())
+        cached_static, static, cached_url, url = rendered.split()
+        self.assertEqual(cached_static, static)
+        self.assertEqual(cached_url, url)
+
+    def test_url_is_reversed_once(self):
+        """Rendering a page twice reverses the index URL only once."""
+        self.client.get(reverse("polls:index"))
+        self.client.get(reverse("polls:index"))
+        info = polls_extras._view_url.cache_info()
+        self.assertGreaterEqual(info.hits, 1)
+
+    def test_warm_templates_loads_every_template(self):
+        """warm_templates compiles all polls and site templates."""
+        names = templating.template_names()
+        self.assertIn("polls/base.html", names)
+        self.assertIn("registration/login.html", names)
+        self.assertEqual(templating.warm_templates(), len(names))
+
+
+class StaticPipelineTests(TestCase):
+    """Tests for the fingerprinted, precompressed static files pipeline."""
+
+    def setUp(self):
+        """Collect the static files into a temporary STATIC_ROOT."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            STATIC_ROOT=directory.name,
+            STATIC_SERVE=True,
+            STORAGES={
+                "default": {"BACKEND": "django.core.files.storage."
+                                       "FileSystemStorage"},
+                "staticfiles": {"BACKEND": "polls.storage."
+                                           "CompressedManifestStaticFilesStorage"},
+            })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.root = directory.name
+        self.css_url = staticfiles_storage.url("polls/style.css")
+
+    def test_assets_are_hashed_and_compressed(self):
+        """Collecting static files writes a hashed name and a gzip copy."""
+        hashed_name = staticfiles_storage.stored_name("polls/style.css")
+        self.assertNotEqual(hashed_name, "polls/style.css")
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, hashed_name + ".gz")))
+
+    def test_serves_gzip_with_far_future_caching(self):
+        """A hashed asset is served compressed and cacheable for a year."""
+        response = self.client.get(self.css_url,
+                                   HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertIn("immutable", response["Cache-Control"])
+        body = gzip.decompress(b"".join(response.streaming_content))
+        self.assertIn(b"font-family", body)
+
+    def test_serves_identity_without_accept_encoding(self):
+        """Clients that do not accept gzip get the plain file."""
+        response = self.client.get(self.css_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_refused_encoding_is_not_served(self):
+        """An encoding with q=0 is not acceptable."""
+        response = self.client.get(self.css_url,
+                                   HTTP_ACCEPT_ENCODING="gzip;q=0, br;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        response = self.client.get(self.css_url,
+                                   HTTP_ACCEPT_ENCODING="*;q=0.5, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_not_modified_keeps_cache_headers(self):
+        """A 304 carries the same caching headers as the full response."""
+        response = self.client.get(self.css_url,
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_unknown_asset_falls_through(self):
+        """Files that were not collected are left to Django."""
+        response = self.client.get("/static/polls/missing.css")
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCompressionTests(TestCase):
+    """Tests for the response compression middleware."""
+
+    def setUp(self):
+        """Create enough polls for a large index page."""
+        for n in range(5):
+            create_question(f"Compressed question {n}", days=-n - 1)
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=100)
+    def test_large_response_is_compressed(self):
+        """Responses above the threshold are gzipped."""
+        response = self.client.get(reverse("polls:index"),
+                                   HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b"Compressed question 4",
+                      gzip.decompress(response.content))
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=10 ** 6)
+    def test_small_response_is_not_compressed(self):
+        """Responses below the threshold are sent as they are."""
+        response = self.client.get(reverse("polls:index"),
+                                   HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @override_settings(RESPONSE_COMPRESSION=False)
+    def test_compression_can_be_disabled(self):
+        """No response is compressed when compression is off."""
+        response = self.client.get(reverse("polls:index"),
+                                   HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+@override_settings(POLLS_STREAMING_INDEX=True)
+class StreamingIndexTests(TestCase):
+    """Tests for the streaming index page."""
+
+    def test_streams_header_before_questions(self):
+        """The page header is the first chunk, before any question."""
+        create_question("Streamed question", days=-1)
+        response = self.client.get(reverse("polls:index"))
+        self.assertTrue(response.streaming)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertIn("<header>", chunks[0])
+        self.assertNotIn("Streamed question", chunks[0])
+        self.assertIn("Streamed question", "".join(chunks))
+        self.assertIn("</html>", chunks[-1])
+
+    def test_streaming_matches_buffered_page(self):
+        """Streaming renders the same questions as the buffered page."""
+        create_question("Past question.", days=-30)
+        create_question("Future question.", days=30)
+        content = b"".join(
+            self.client.get(reverse("polls:index")).streaming_content)
+        self.assertIn(b"Past question.", content)
+        self.assertNotIn(b"Future question.", content)
+
+    def test_no_questions(self):
+        """An empty list streams the 'no polls' message."""
+        content = b"".join(
+            self.client.get(reverse("polls:index")).streaming_content)
+        self.assertIn(b"No polls are available.", content)
+
+    def test_sets_csrf_cookie(self):
+        """The CSRF cookie is set although the page renders after it."""
+        response = self.client.get(reverse("polls:index"))
+        b"".join(response.streaming_content)
+        self.assertIn("csrftoken", response.cookies)
+
+
+class ReplicaRoutingTests(TestCase):
+    """Tests for routing poll browsing reads to a read replica."""
+
+    def setUp(self):
+        """Create a question and record the router's read decisions."""
+        self.question = create_question("Replica question", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="One")
+        self.reads = []
+        original = routers.PrimaryReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            self.reads.append((model._meta.model_name, alias))
+            return alias
+
+        patcher = mock.patch.object(routers.PrimaryReplicaRouter,
+                                    "db_for_read", spy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # the test database has no second alias, so the "replica" is the
+        # primary connection; the decisions are what is being tested
+        settings_override = override_settings(DATABASE_REPLICA_ALIAS="default")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_router_outside_replica_views(self):
+        """Reads go to the primary unless replica reads are enabled."""
+        router = routers.PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Question))
+        self.assertEqual(router.db_for_write(Question), "default")
+
+    def test_results_read_from_replica(self):
+        """The results page reads polls models from the replica."""
+        self.client.get(reverse("polls:results", args=[self.question.id]))
+        self.assertIn(("question", "default"), self.reads)
+        self.assertFalse(routers.replica_reads_enabled())
+
+    def test_results_are_built_from_primary(self):
+        """Totals built on the results page count the primary's votes."""
+        self.client.get(reverse("polls:results", args=[self.question.id]))
+        replica_models = {model for model, alias in self.reads if alias}
+        self.assertFalse(replica_models & {"vote", "guestvote", "choice"})
+        self.assertIn("question", replica_models)
+
+    def test_auth_reads_stay_on_primary(self):
+        """Sessions and users are never read from the replica."""
+        user = User.objects.create_user(username="reader", password="pw")
+        self.client.force_login(user)
+        self.client.get(reverse("polls:index"))
+        self.assertIn(("user", None), self.reads)
+        self.assertIn(("question", "default"), self.reads)
+
+    def test_reads_pinned_to_primary_after_vote(self):
+        """After voting, the voter's results are read from the primary."""
+        cache.clear()
+        user = User.objects.create_user(username="voter2", password="pw")
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse("polls:vote", args=[self.question.id]),
+            {"choice": self.choice.id})
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.reads.clear()
+        self.client.get(reverse("polls:results", args=[self.question.id]))
+        self.assertNotIn(("question", "default"), self.reads)
+
+    def test_no_replica_configured(self):
+        """Without a replica alias every read uses the primary."""
+        with self.settings(DATABASE_REPLICA_ALIAS=None):
+            self.client.get(reverse("polls:index"))
+        self.assertNotIn(("question", "default"), self.reads)
+
+
+class QuestionResultTests(TestCase):
+    """Tests for the precomputed question results."""
+
+    def setUp(self):
+        """Create a question with two choices and two voters."""
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+        self.question = create_question("Results question", days=-1)
+        self.choice1 = self.question.choice_set.create(choice_text="One")
+        self.choice2 = self.question.choice_set.create(choice_text="Two")
+        self.users = [User.objects.create_user(username=f"r{n}",
+                                               password="pw")
+                      for n in range(2)]
+        self.vote_url = reverse("polls:vote", args=[self.question.id])
+
+    def vote(self, user, choice):
+        """Vote for `choice` as `user`."""
+        self.client.force_login(user)
+        self.client.post(self.vote_url, {"choice": choice.id})
+
+    def totals(self):
+        """Return the stored totals as {choice id: votes}."""
+        result = QuestionResult.objects.get(question=self.question)
+        return dict(result.choices.values_list("choice", "votes"))
+
+    def test_votes_update_results_incrementally(self):
+        """Casting and changing votes keeps the totals up to date."""
+        self.vote(self.users[0], self.choice1)
+        self.vote(self.users[1], self.choice1)
+        self.vote(self.users[1], self.choice2)
+        self.assertEqual(self.totals(),
+                         {self.choice1.id: 1, self.choice2.id: 1})
+        self.assertEqual(self.question.result.voter_count, 2)
+        self.assertEqual(results.check_results(self.question), [])
+
+    def test_results_view_does_not_count_votes(self):
+        """The results page reads totals without counting Vote rows."""
+        self.vote(self.users[0], self.choice2)
+        url = reverse("polls:results", args=[self.question.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(
+            [query for query in queries if "polls_vote" in query["sql"]])
+        self.assertContains(response, "<td>1</td>", html=True)
+
+    def test_deleted_vote_leaves_totals(self):
+        """Deleting a vote takes it out of the totals."""
+        self.vote(self.users[0], self.choice1)
+        Vote.objects.get(user=self.users[0]).delete()
+        self.assertEqual(self.totals()[self.choice1.id], 0)
+        self.assertEqual(results.check_results(self.question), [])
+
+    def test_checker_finds_and_fixes_drift(self):
+        """check_results reports drift and --fix repairs it."""
+        self.vote(self.users[0], self.choice1)
+        # a vote written behind the vote path's back
+        Vote.objects.create(user=self.users[1], choice=self.choice2)
+        self.assertTrue(results.check_results(self.question))
+        with self.assertRaises(CommandError):
+            call_command("check_results", stdout=io.StringIO())
+        call_command("check_results", fix=True, stdout=io.StringIO())
+        self.assertEqual(results.check_results(self.question), [])
+        self.assertEqual(self.totals()[self.choice2.id], 1)
+
+    def test_loaded_choice_keeps_totals(self):
+        """Choices saved by loaddata (raw) do not get a total added."""
+        self.vote(self.users[0], self.choice1)
+        choice = Choice(question=self.question, choice_text="Loaded")
+        choice.save_base(raw=True)
+        self.assertNotIn(choice.id, self.totals())
+
+    def test_changed_vote_reads_locked_vote(self):
+        """The previous vote is read with a row lock."""
+        self.vote(self.users[0], self.choice1)
+        with mock.patch.object(
+                models.QuerySet, "select_for_update", autospec=True,
+                side_effect=models.QuerySet.select_for_update) as lock:
+            self.vote(self.users[0], self.choice2)
+        self.assertTrue(lock.called)
+        self.assertEqual(self.totals(),
+                         {self.choice1.id: 0, self.choice2.id: 1})
+
+    def test_concurrent_first_vote_is_counted_once(self):
+        """A first vote that loses the race becomes a change of vote."""
+        self.vote(self.users[0], self.choice1)
+        # the lookup ran before the other request's vote was committed
+        with mock.patch.object(models.QuerySet, "first", return_value=None):
+            self.vote(self.users[0], self.choice2)
+        self.assertEqual(Vote.objects.get().choice, self.choice2)
+        self.assertEqual(self.totals(),
+                         {self.choice1.id: 0, self.choice2.id: 1})
+
+
+class LifecycleTests(TestCase):
+    """Tests for the poll lifecycle scheduler and the cached index."""
+
+    def setUp(self):
+        """Start with an empty cache."""
+        cache.clear()
+
+    def test_scheduler_orders_transitions(self):
+        """Upcoming publish and close instants are queued by time."""
+        now = timezone.now()
+        later = create_question("Later", days=2)
+        sooner = create_question("Sooner", days=1)
+        closing = create_question("Closing", days=-1)
+        closing.end_date = now + datetime.timedelta(hours=1)
+        closing.save()
+        scheduler = lifecycle.LifecycleScheduler()
+        scheduler.load(now)
+        order = [heapq.heappop(scheduler.queue)[1:] for _ in range(3)]
+        self.assertEqual(order, [(lifecycle.CLOSE, closing.id),
+                                 (lifecycle.PUBLISH, sooner.id),
+                                 (lifecycle.PUBLISH, later.id)])
+
+    def test_close_freezes_results(self):
+        """When a poll closes its final results are frozen."""
+        now = timezone.now()
+        question = create_question("Closing poll", days=-1)
+        question.end_date = now + datetime.timedelta(minutes=1)
+        question.save()
+        question.choice_set.create(choice_text="One")
+        scheduler = lifecycle.LifecycleScheduler()
+        scheduler.load(now)
+        applied = scheduler.run_due(now + datetime.timedelta(minutes=2))
+        self.assertEqual([kind for _, kind, _ in applied], [lifecycle.CLOSE])
+        self.assertIsNotNone(
+            QuestionResult.objects.get(question=question).frozen_at)
+
+    def test_publish_refreshes_cached_index(self):
+        """A published poll appears on the index once its time comes."""
+        question = create_question("Soon", days=-1)
+        question.pub_date = timezone.now() + datetime.timedelta(seconds=1)
+        question.save()
+        self.assertEqual(lifecycle.index_question_ids(), [])
+        scheduler = lifecycle.LifecycleScheduler()
+        scheduler.load()
+        with mock.patch("polls.lifecycle.timezone.now",
+                        return_value=question.pub_date):
+            scheduler.run_due()
+            self.assertEqual(lifecycle.index_question_ids(), [question.id])
+
+    def test_index_is_served_from_cache(self):
+        """The index question ids are not queried again while cached."""
+        create_question("Cached", days=-1)
+        lifecycle.warm_index()
+        with CaptureQueriesContext(connection) as queries:
+            lifecycle.index_question_ids()
+        self.assertEqual(len(queries), 0)
+
+    def test_catch_up_freezes_closed_polls(self):
+        """Polls that closed while nothing ran are frozen on startup."""
+        question = create_question("Closed", days=-3)
+        question.end_date = timezone.now() - datetime.timedelta(days=1)
+        question.save()
+        call_command("run_lifecycle", once=True, stdout=io.StringIO())
+        self.assertIsNotNone(question.result.frozen_at)
+
+    def test_scheduler_requires_shared_cache(self):
+        """The scheduler refuses a cache private to its own process."""
+        self.assertFalse(lifecycle.cache_is_shared())
+        self.assertEqual([warning.id for warning in
+                          lifecycle.check_shared_cache(None)], ["polls.W001"])
+        with self.assertRaises(CommandError):
+            call_command("run_lifecycle", stdout=io.StringIO())
+
+    def test_invalidation_reaches_other_processes(self):
+        """With a shared cache the scheduler refreshes the server's index."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = "django.core.cache.backends.filebased.FileBasedCache"
+        with override_settings(CACHES={"default": {
+                "BACKEND": backend, "LOCATION": directory.name}}):
+            self.assertTrue(lifecycle.cache_is_shared())
+            self.assertEqual(lifecycle.check_shared_cache(None), [])
+            self.assertEqual(lifecycle.index_question_ids(), [])
+            # bulk_create sends no post_save, so this process keeps its
+            # cached index
+            question, = Question.objects.bulk_create([Question(
+                question_text="Shared", pub_date=timezone.now())])
+            self.assertEqual(lifecycle.index_question_ids(), [])
+            # the scheduler process, with its own cache connection
+            scheduler_cache = FileBasedCache(directory.name, {})
+            scheduler_cache.delete(lifecycle.INDEX_CACHE_KEY)
+            self.assertEqual(lifecycle.index_question_ids(), [question.id])
+
+
+class ProfilingTests(TestCase):
+    """Tests for the opt-in request profiling."""
+
+    def setUp(self):
+        """Log in a staff user with profiling writing to a temp directory."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(
+            POLLS_PROFILING=True, POLLS_PROFILING_DIR=self.directory))
+        self.user = User.objects.create_user(username="staff", password="pw",
+                                             is_staff=True)
+        self.client.force_login(self.user)
+        self.question = create_question("Profiled", days=-1)
+        self.question.choice_set.create(choice_text="One")
+        self.url = reverse("polls:results", args=(self.question.id,))
+
+    def test_profile_header_writes_profile_and_trace(self):
+        """A profiled request writes a cProfile file and its SQL trace."""
+        self.client.get(self.url, HTTP_X_POLLS_PROFILE="1")
+        names = os.listdir(self.directory)
+        self.assertEqual(len([n for n in names if n.endswith(".prof")]), 1)
+        trace = [n for n in names if n.endswith(".sql.json")]
+        self.assertTrue(trace[0].startswith("polls.results-"))
+
+    def test_unmarked_request_is_not_profiled(self):
+        """Without the header or sampling nothing is written."""
+        self.client.get(self.url)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_non_staff_cannot_profile(self):
+        """The header is ignored for users who are not staff."""
+        self.user.is_staff = False
+        self.user.save()
+        self.client.get(self.url, HTTP_X_POLLS_PROFILE="1")
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_concurrent_request_is_served_unprofiled(self):
+        """A request arriving while another is profiled is not profiled."""
+        with profiling._cprofile_lock:
+            response = self.client.get(self.url, HTTP_X_POLLS_PROFILE="1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_active_profiler_does_not_fail_request(self):
+        """A profiler already active elsewhere only skips the profile."""
+        with mock.patch("polls.profiling.cProfile.Profile.enable",
+                        side_effect=ValueError):
+            response = self.client.get(self.url, HTTP_X_POLLS_PROFILE="1")
+        self.assertEqual(response.status_code, 200)
+        names = os.listdir(self.directory)
+        self.assertFalse([n for n in names if n.endswith(".prof")])
+        self.assertTrue([n for n in names if n.endswith(".sql.json")])
+
+    @override_settings(POLLS_PROFILING_MODE="sample")
+    def test_sampling_mode_and_report(self):
+        """Stack samples are written and summarized per view."""
+        self.client.get(self.url, HTTP_X_POLLS_PROFILE="1")
+        names = os.listdir(self.directory)
+        self.assertTrue(any(n.endswith(".stacks") for n in names))
+        out = io.StringIO()
+        call_command("profile_report", stdout=out)
+        self.assertIn("== polls.results (1 requests)", out.getvalue())
+        self.assertIn("polls_question", out.getvalue())
+
+
+@override_settings(POLLS_METRICS_TOKEN="secret")
+class MetricsTests(TestCase):
+    """Tests for the Prometheus metrics."""
+
+    def setUp(self):
+        """Start from empty metrics, cache and vote window."""
+        for metric in metrics._registry:
+            metric.reset()
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+        self.question = create_question("Measured", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="One")
+        self.other = self.question.choice_set.create(choice_text="Two")
+
+    def scrape(self):
+        """Request the metrics with the scraper's token."""
+        return self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+
+    def test_counts_requests_per_url_name(self):
+        """Requests are counted and timed per URL name."""
+        self.client.get(reverse("polls:detail", args=(self.question.id,)))
+        body = self.scrape().content.decode()
+        self.assertIn('polls_http_requests_total{view="polls:detail",'
+                      'method="GET",status="200"} 1', body)
+        self.assertIn('polls_http_request_duration_seconds_count'
+                      '{view="polls:detail"} 1', body)
+        self.assertIn('polls_db_queries_per_request_bucket'
+                      '{view="polls:detail",le="+Inf"} 1', body)
+
+    def test_counts_vote_kinds_and_cache_lookups(self):
+        """Created, updated and coalesced votes are counted apart."""
+        user = User.objects.create_user(username="counted", password="pw")
+        self.client.force_login(user)
+        url = reverse("polls:vote", args=(self.question.id,))
+        self.client.post(url, {"choice": self.choice.id})
+        self.client.post(url, {"choice": self.choice.id})
+        self.client.post(url, {"choice": self.other.id})
+        self.assertEqual(metrics.VOTES.values(), {
+            ("created",): 1, ("coalesced",): 1, ("updated",): 1})
+        lookups = metrics.CACHE_REQUESTS.values()
+        self.assertEqual(lookups[("vote_idempotency", "miss")], 1)
+        self.assertEqual(lookups[("vote_idempotency", "hit")], 2)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Each bucket counts the observations at or below its bound."""
+        histogram = metrics.Histogram("test_seconds", "Test.",
+                                      buckets=(1, 2))
+        metrics._registry.remove(histogram)
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        samples = list(histogram.samples(histogram.values()))
+        self.assertEqual([value for _, _, _, value in samples],
+                         [2, 3, 4, 6.0, 4])
+
+    def test_adds_up_other_process_snapshots(self):
+        """Snapshots written by other workers are added to the totals."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        metrics.LOGIN_FAILURES.inc(2)
+        with override_settings(POLLS_METRICS_DIR=directory.name):
+            metrics.write_snapshot()
+            os.rename(os.path.join(directory.name,
+                                   f"metrics-{os.getpid()}.json"),
+                      os.path.join(directory.name, "metrics-1.json"))
+            totals = metrics.collect()
+        self.assertEqual(totals["polls_login_failures_total"][()], 4)
+
+    def test_token_is_required(self):
+        """Scrapers must send the configured bearer token."""
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.scrape().status_code, 200)
+
+    @override_settings(POLLS_METRICS_TOKEN="")
+    def test_hidden_without_token(self):
+        """Without a configured token the endpoint does not exist."""
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_shards_of_ended_threads_are_merged(self):
+        """Shards do not pile up as threads come and go."""
+        counter = metrics.Counter("test_total", "Test.")
+        metrics._registry.remove(counter)
+        for _ in range(5):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+        counter.inc()
+        self.assertEqual(len(counter._shards), 1)
+        self.assertEqual(counter.values(), {(): 6})
+
+
+class VoteQuestionTests(TestCase):
+    """Tests for votes stored and queried by question."""
+
+    def setUp(self):
+        """Create a question with two choices and a voter."""
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+        self.question = create_question("Stored", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="One")
+        self.other = self.question.choice_set.create(choice_text="Two")
+        self.user = User.objects.create_user(username="sharded",
+                                             password="pw")
+
+    def test_vote_takes_question_from_choice(self):
+        """A vote saved without a question gets its choice's question."""
+        vote = Vote.objects.create(user=self.user, choice=self.choice)
+        self.assertEqual(vote.question_id, self.question.id)
+
+    def test_changed_choice_moves_the_question(self):
+        """A vote moved to a choice of another question follows it."""
+        vote = Vote.objects.create(user=self.user, choice=self.choice)
+        elsewhere = create_question("Elsewhere", days=-1).choice_set.create(
+            choice_text="Three")
+        vote.choice = elsewhere
+        vote.save()
+        self.assertEqual(vote.question_id, elsewhere.question_id)
+
+    def test_loaded_votes_get_their_question(self):
+        """Fixtures without the question field still load."""
+        call_command("loaddata", "data/polls-v4.json", "data/users.json",
+                     "data/votes-v4.json", verbosity=0)
+        self.assertFalse(Vote.objects.exclude(
+            question_id=models.F("choice__question_id")).exists())
+
+    def test_vote_path_does_not_join_choices(self):
+        """Votes are looked up and counted by question, without a join."""
+        self.client.force_login(self.user)
+        url = reverse("polls:vote", args=(self.question.id,))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {"choice": self.choice.id})
+            self.client.post(url, {"choice": self.other.id})
+        vote_queries = [query["sql"] for query in queries
+                        if 'FROM "polls_vote"' in query["sql"]]
+        self.assertTrue(vote_queries)
+        for sql in vote_queries:
+            self.assertNotIn('JOIN "polls_choice"', sql)
+        self.assertEqual(results.count_votes(self.question),
+                         ({self.other.id: 1}, 1))
+
+    def test_one_vote_per_user_and_question(self):
+        """The database refuses a second vote of a user on a question."""
+        Vote.objects.create(user=self.user, choice=self.choice)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=self.other)
+
+    def test_partitioning_needs_postgres(self):
+        """partition_votes refuses to run on other databases."""
+        with self.assertRaises(CommandError):
+            call_command("partition_votes", stdout=io.StringIO())
+
+
+class PollImportTests(TestCase):
+    """Tests for the bulk poll import."""
+
+    CSV = ("question_text,pub_date,end_date,choices\n"
+           "Best editor?,2025-01-06T09:00,2025-01-13,vim|emacs|nano\n"
+           "Lunch?,,,pizza|noodles\n")
+
+    def test_import_csv(self):
+        """Every row becomes a question with its choices."""
+        report = importer.import_polls(self.CSV, "csv")
+        self.assertEqual((report["questions"], report["choices"]), (2, 5))
+        question = Question.objects.get(question_text="Best editor?")
+        self.assertEqual(timezone.localtime(question.end_date).date(),
+                         datetime.date(2025, 1, 13))
+        self.assertEqual(
+            list(question.choice_set.values_list("choice_text", flat=True)
+                 .order_by("id")), ["vim", "emacs", "nano"])
+
+    def test_invalid_file_imports_nothing(self):
+        """One bad row reports every problem and writes no polls."""
+        content = json.dumps([
+            {"question_text": "Fine", "choices": ["a", "b"]},
+            {"question_text": "", "choices": []},
+            {"question_text": "Dates", "pub_date": "2025-02-01",
+             "end_date": "2025-01-01", "choices": ["a"]},
+        ])
+        with self.assertRaises(ValidationError) as raised:
+            importer.import_polls(content, "json")
+        self.assertEqual(len(raised.exception.messages), 3)
+        self.assertFalse(Question.objects.exists())
+
+    def test_backend_without_returned_ids(self):
+        """Where bulk inserts return no ids, choices still get questions."""
+        with mock.patch.object(type(connection.features),
+                               "can_return_rows_from_bulk_insert", False):
+            importer.import_polls(self.CSV, "csv")
+        question = Question.objects.get(question_text="Lunch?")
+        self.assertEqual(question.choice_set.count(), 2)
+
+    def test_inserts_in_batches(self):
+        """Questions and choices are inserted with one query per batch."""
+        content = json.dumps([
+            {"question_text": f"Poll {number}", "choices": ["yes", "no"]}
+            for number in range(50)])
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_polls(content, "json", batch_size=100)
+        inserts = [query for query in queries
+                   if query["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(Choice.objects.count(), 100)
+
+    def test_import_command_reports_throughput(self):
+        """import_polls reads a file and reports polls per second."""
+        with tempfile.NamedTemporaryFile(
+                "w", suffix=".csv", delete=False) as file:
+            file.write(self.CSV)
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command("import_polls", file.name, stdout=out)
+        self.assertIn("Imported 2 questions and 5 choices", out.getvalue())
+        self.assertIn("polls/sec", out.getvalue())
+
+    def test_admin_import_page(self):
+        """Staff with the add permission can upload a file in the admin."""
+        admin = User.objects.create_superuser(username="admin",
+                                              password="pw")
+        self.client.force_login(admin)
+        url = reverse("admin:polls_question_import")
+        upload = SimpleUploadedFile("polls.csv", self.CSV.encode())
+        response = self.client.post(url, {"file": upload})
+        self.assertRedirects(
+            response, reverse("admin:polls_question_changelist"))
+        self.assertEqual(Question.objects.count(), 2)
+
+
+class QueryBudgetTests(TestCase):
+    """Upper bounds on the queries of the main pages.
+
+    A change that adds a query to one of these pages fails here, so a new
+    N+1 pattern is noticed before it reaches production.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a few polls with choices and a voter."""
+        cls.user = User.objects.create_user(username="budget",
+                                            password="pw")
+        cls.questions = []
+        for number in range(5):
+            question = create_question(f"Budget {number}", days=-1)
+            for text in ("One", "Two", "Three"):
+                question.choice_set.create(choice_text=text)
+            cls.questions.append(question)
+        cls.question = cls.questions[0]
+        cls.choice = cls.question.choice_set.first()
+
+    def setUp(self):
+        """Start with an empty cache and vote window."""
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+
+    def test_index(self):
+        """The cached index lists five polls in one query."""
+        lifecycle.warm_index()
+        with self.assertNumQueries(1):
+            self.client.get(reverse("polls:index"))
+
+    def test_detail_anonymous(self):
+        """An anonymous visitor's detail page needs two queries."""
+        with self.assertNumQueries(2):
+            self.client.get(reverse("polls:detail",
+                                    args=(self.question.id,)))
+
+    def test_results(self):
+        """Results read the stored totals, whatever the number of votes."""
+        results.refresh_results(self.question)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("polls:results",
+                                    args=(self.question.id,)))
+
+    def test_vote(self):
+        """A first vote, including session and user lookups.
+
+        Under the test transaction each atomic block adds a savepoint and
+        its release; the vote and its totals share one, and the insert has
+        its own so a concurrent first vote can be caught.
+        """
+        results.refresh_results(self.question)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(15):
+            self.client.post(reverse("polls:vote", args=(self.question.id,)),
+                             {"choice": self.choice.id})
+
+
+class GuestVotingTests(TestCase):
+    """Tests for voting without an account."""
+
+    def setUp(self):
+        """Create a guest question with two choices and open it."""
+        cache.clear()
+        ratelimit.get_vote_window().hits.clear()
+        ratelimit.get_guest_ip_window().hits.clear()
+        self.question = create_question("Open to all", days=-1)
+        self.question.allow_guests = True
+        self.question.save()
+        self.choice = self.question.choice_set.create(choice_text="One")
+        self.other = self.question.choice_set.create(choice_text="Two")
+        self.url = reverse("polls:vote", args=(self.question.id,))
+        self.detail_url = reverse("polls:detail", args=(self.question.id,))
+        self.open_poll()
+
+    def open_poll(self):
+        """Open the poll as a new device, which sets its device cookie."""
+        self.client.cookies.clear()
+        response = self.client.get(self.detail_url)
+        self.assertIn(guests.DEVICE_COOKIE, response.cookies)
 
-def test_voting_with_authentication(self):
-    """An authenticated user can submit a vote."""
-    vote_url = reverse('polls:vote', args=[self.question.id])
-    choice = self.question.choice_set.first()
-    form_data = {"choice": f"{choice.id}"}
+    def test_guest_vote_is_counted(self):
+        """A guest vote from an opened poll counts in the results."""
+        response = self.client.post(self.url, {"choice": self.choice.id})
+        self.assertRedirects(
+            response, reverse("polls:results", args=(self.question.id,)))
+        result = results.get_results(self.question)
+        self.assertEqual(result.voter_count, 1)
+        self.assertEqual(self.choice.result.votes, 1)
+        self.assertEqual(results.check_results(self.question), [])
 
-    # Login the user
-    self.client.login(username=self.username, password=self.password)
+    def test_same_device_changes_its_vote(self):
+        """A second vote from the same device replaces the first."""
+        self.client.post(self.url, {"choice": self.choice.id})
+        self.client.post(self.url, {"choice": self.other.id})
+        self.assertEqual(
+            list(GuestVote.objects.values_list("choice_id", flat=True)),
+            [self.other.id])
+        self.assertEqual(results.get_results(self.question).voter_count, 1)
+        self.assertEqual(results.check_results(self.question), [])
 
-    # Submit a vote
-    response = self.client.post(vote_url, form_data)
+    def test_votes_without_cookie_are_not_counted(self):
+        """Posting without the device cookie never adds a vote."""
+        self.client.post(self.url, {"choice": self.choice.id})
+        for choice in (self.choice, self.other):
+            self.client.cookies.clear()
+            response = self.client.post(self.url, {"choice": choice.id})
+            self.assertRedirects(response, self.detail_url,
+                                 fetch_redirect_response=False)
+        self.assertEqual(GuestVote.objects.count(), 1)
+        self.assertEqual(results.get_results(self.question).voter_count, 1)
 
-    # Check that the vote was recorded
-    self.assertRedirects(response,
-                         reverse('polls:results', args=[self.question.id]))
-    self.assertEqual(choice.votes, 1)
+    @override_settings(GUEST_VOTE_RATE_LIMIT_IP=2)
+    def test_guests_are_throttled_per_ip(self):
+        """New devices from one IP cannot vote without limit."""
+        statuses = []
+        for _ in range(3):
+            self.open_poll()
+            statuses.append(self.client.post(
+                self.url, {"choice": self.choice.id}).status_code)
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(GuestVote.objects.count(), 2)
 
+    @override_settings(GUEST_VOTE_RATE_LIMIT_IP=2)
+    def test_forged_forwarded_for_does_not_reset_ip_limit(self):
+        """A client cannot pick a new IP with X-Forwarded-For."""
+        statuses = []
+        for number in range(3):
+            self.open_poll()
+            statuses.append(self.client.post(
+                self.url, {"choice": self.choice.id},
+                HTTP_X_FORWARDED_FOR=f"10.0.0.{number}").status_code)
+        self.assertEqual(statuses, [302, 302, 429])
 
-def test_changing_vote(self):
-    """An authenticated user can change their vote during the voting period."""
-    vote_url = reverse('polls:vote', args=[self.question.id])
-    choice1 = self.question.choice_set.first()
-    choice2 = self.question.choice_set.last()
-    form_data = {"choice": f"{choice1.id}"}
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_client_ip_trusts_only_own_proxies(self):
+        """Only the address added by a trusted proxy is used."""
+        request = django.test.RequestFactory().get(
+            "/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2",
+            REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(ratelimit.client_ip(request), "2.2.2.2")
+        with self.settings(TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(ratelimit.client_ip(request), "10.0.0.1")
 
-    # Login the user
-    self.client.login(username=self.username, password=self.password)
+    def test_new_device_skips_the_lookup(self):
+        """The first vote of a device is inserted without a lookup."""
+        self.client.post(self.url, {"choice": self.choice.id})
+        self.open_poll()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {"choice": self.other.id})
+        selects = [query["sql"] for query in queries
+                   if query["sql"].startswith("SELECT")]
+        self.assertFalse([sql for sql in selects if "polls_guestvote" in sql])
+        self.assertEqual(GuestVote.objects.count(), 2)
 
-    # Submit an initial vote
-    self.client.post(vote_url, form_data)
+    def test_previous_vote_is_locked(self):
+        """The device's previous vote is read with a row lock."""
+        self.client.post(self.url, {"choice": self.choice.id})
+        with mock.patch.object(
+                models.QuerySet, "select_for_update", autospec=True,
+                side_effect=models.QuerySet.select_for_update) as lock:
+            self.client.post(self.url, {"choice": self.other.id})
+        self.assertTrue(lock.called)
+        self.assertEqual(results.check_results(self.question), [])
 
-    # Change the vote
-    form_data = {"choice": f"{choice2.id}"}
-    response = self.client.post(vote_url, form_data)
+    def test_tampered_cookie_is_not_trusted(self):
+        """A cookie with a bad signature cannot vote and gets replaced."""
+        self.client.cookies[guests.DEVICE_COOKIE] = "forged"
+        self.client.post(self.url, {"choice": self.choice.id})
+        self.assertFalse(GuestVote.objects.exists())
+        response = self.client.get(self.detail_url)
+        self.assertNotEqual(
+            response.cookies[guests.DEVICE_COOKIE].value, "forged")
 
-    # Check that the vote was updated
-    self.assertRedirects(response,
-                         reverse('polls:results', args=[self.question.id]))
-    self.assertEqual(choice1.votes, 0)
-    self.assertEqual(choice2.votes, 1)
+    def test_questions_without_guests_need_login(self):
+        """Guests are sent to the login page unless the poll allows them."""
+        self.question.allow_guests = False
+        self.question.save()
+        response = self.client.post(self.url, {"choice": self.choice.id})
+        self.assertRedirects(
+            response, f"{reverse('login')}?next={self.url}",
+            fetch_redirect_response=False)
+        self.assertFalse(GuestVote.objects.exists())
@@ -5,32 +5,48 @@ from django.contrib.auth.signals import user_logged_in, user_logged_out, \
 from django.utils.timezone import now
 from django.dispatch import receiver
 from django.urls import reverse
-from django.http import HttpResponseRedirect, Http404
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, Http404, \
+    StreamingHttpResponse
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views import generic
 from django.utils import timezone
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.views import LoginView as AuthLoginView
+from django.db import IntegrityError, transaction
+from django.middleware.csrf import get_token
+from . import events, guests, lifecycle, metrics, ratelimit, results, \
+    routers
 from .models import Choice, Question, Vote
 
 logger = logging.getLogger('polls')
 
+# placeholder for the question list in polls/index_stream.html
+STREAM_MARKER = "<!-- polls:question-list -->"
+
 
 @receiver(user_logged_in)
 def user_logged_in_handler(sender, request, user, **kwargs):
     """Log user login events."""
+    ip = get_client_ip(request)
     logger.info(
-        f'User {user.username} logged in at {now()} from '
-        f'IP {get_client_ip(request)}.')
+        f'User {user.username} logged in at {now()} from IP {ip}.')
+    events.record(events.LOGIN, username=user.username, ip=ip)
+    ratelimit.reset_login_failures(user.username)
 
 
 @receiver(user_logged_out)
 def user_logged_out_handler(sender, request, user, **kwargs):
     """Log user logout events."""
+    ip = get_client_ip(request)
+    username = user.username if user else 'unknown'
     logger.info(
-        f'User {user.username} logged out at {now()} from '
-        f'IP {get_client_ip(request)}.')
+        f'User {username} logged out at {now()} from IP {ip}.')
+    events.record(events.LOGOUT, username=username, ip=ip)
 
 
 @receiver(user_login_failed)
@@ -41,24 +57,92 @@ def user_login_failed_handler(sender, credentials, request, **kwargs):
     logger.warning(
         f'Unsuccessful login attempt for '
         f'username {username} at {now()} from IP {ip}.')
+    events.record(events.LOGIN_FAILED, username=username, ip=ip)
+    metrics.LOGIN_FAILURES.inc()
+    limit_ip = ratelimit.client_ip(request) if request is not None else None
+    # an attempt refused by the rate limit checked no password, so it must
+    # not extend the block
+    if not ratelimit.login_limited(limit_ip, username):
+        ratelimit.record_login_failure(limit_ip, username)
+
+
+class LoginView(AuthLoginView):
+    """Login view that answers rate-limited attempts with 429.
+
+    `RateLimitedModelBackend` refuses blocked logins on every login page;
+    this view only turns them into a 429 response before the form runs.
+    """
+
+    def post(self, request, *args, **kwargs):
+        """Refuse the login with 429 if the IP or username is blocked."""
+        ip = ratelimit.client_ip(request)
+        username = request.POST.get('username', '')
+        if ratelimit.login_blocked(ip, username):
+            logger.warning(
+                f'Blocked login attempt for username {username} '
+                f'at {now()} from IP {ip}: too many failures.')
+            messages.error(
+                request,
+                "Too many failed login attempts. Please try again later.")
+            context = self.get_context_data(form=self.form_class(request))
+            return self.render_to_response(context, status=429)
+        return super().post(request, *args, **kwargs)
 
 
 class IndexView(generic.ListView):
     """Display five most recent polls."""
 
+    read_from_replica = True
     template_name = "polls/index.html"
     context_object_name = "latest_question_list"
 
     def get_queryset(self):
         """Return the last five published questions."""
         return Question.objects.filter(
+            pk__in=lifecycle.index_question_ids(),
             pub_date__lte=timezone.now()
-        ).order_by("-pub_date")[:5]
+        ).order_by("-pub_date")
+
+    def render_to_response(self, context, **response_kwargs):
+        """Stream the page when `POLLS_STREAMING_INDEX` is enabled."""
+        if not getattr(settings, "POLLS_STREAMING_INDEX", False):
+            return super().render_to_response(context, **response_kwargs)
+        # the template renders after CsrfViewMiddleware has processed the
+        # response, so the token must be requested now for its cookie to
+        # be set
+        get_token(self.request)
+        return StreamingHttpResponse(self.stream(context))
+
+    def stream(self, context):
+        """Yield the page header, then each question card, then the footer.
+
+        The header is sent before the questions are fetched, so the
+        browser can start loading the stylesheet meanwhile. Only the ids of
+        the index questions, usually cached, are looked up before it.
+        """
+        page = get_template("polls/index_stream.html").render(
+            {**context, "stream_marker": mark_safe(STREAM_MARKER)},
+            self.request)
+        header, footer = page.split(STREAM_MARKER)
+        yield header
+        card = get_template("polls/question_card.html")
+        questions = context[self.context_object_name]
+        if hasattr(questions, "iterator"):
+            questions = questions.iterator()
+        empty = True
+        for question in questions:
+            if empty:
+                yield '<div class="question-container">'
+                empty = False
+            yield card.render({"question": question}, self.request)
+        yield "<p>No polls are available.</p>" if empty else "</div>"
+        yield footer
 
 
 class DetailView(generic.DetailView):
     """Display the choices for a poll and allow voting."""
 
+    read_from_replica = True
     model = Question
     template_name = "polls/detail.html"
 
@@ -80,11 +164,12 @@ class DetailView(generic.DetailView):
             messages.error(request, "Question does not exist.")
             return redirect("polls:index")
         if not this_user.is_authenticated:  # user is not logged in
-            select_choice = ""
+            select_choice = guests.guest_choice(
+                request, selected_question) or ""
         else:  # user is logged in
             try:
                 vote = Vote.objects.get(user=this_user,
-                                        choice__question=selected_question)
+                                        question=selected_question)
                 select_choice = vote.choice
             except Vote.DoesNotExist:  # user has not voted yet
                 select_choice = ""
@@ -98,15 +183,23 @@ class DetailView(generic.DetailView):
             return redirect("polls:index")
         # Render the page
         # return super().get(request, *args, **kwargs)
-        self.object = self.get_object()
+        # the question is already loaded, so do not fetch it again
+        self.object = selected_question
         context = self.get_context_data(object=self.object)
         context["select_choice"] = select_choice
-        return self.render_to_response(context)
+        response = self.render_to_response(context)
+        # a guest can only vote with a device token issued here
+        if selected_question.allow_guests and \
+                not this_user.is_authenticated and \
+                guests.get_device_token(request) is None:
+            guests.set_device_token(response, guests.new_device_token())
+        return response
 
 
 class ResultsView(generic.DetailView):
     """Result view displays the results of a poll."""
 
+    read_from_replica = True
     model = Question
     template_name = "polls/results.html"
 
@@ -122,15 +215,43 @@ class ResultsView(generic.DetailView):
         if not selected_question.is_published():
             messages.error(request, "This question is not yet published.")
             return redirect("polls:index")
-        return super().get(request, *args, **kwargs)
+        self.object = selected_question
+        return self.render_to_response(
+            self.get_context_data(object=self.object))
+
+    def get_context_data(self, **kwargs):
+        """Add the precomputed vote totals of the question."""
+        context = super().get_context_data(**kwargs)
+        result = results.get_results(self.object)
+        context["result"] = result
+        context["choice_results"] = result.choices.select_related(
+            "choice").order_by("choice_id")
+        return context
 
 
-@login_required
 def vote(request, question_id):
     """Handle user votes in a Django application."""
+    if not request.user.is_authenticated:
+        return guest_vote(request, question_id)
+    # a double-click resubmits the same vote: answer it without the DB
+    choice_id = request.POST.get("choice")
+    if ratelimit.claim_vote(request.user.id, question_id, choice_id):
+        metrics.VOTES.inc(kind="coalesced")
+        return HttpResponseRedirect(
+            reverse("polls:results", args=(question_id,)))
+    if ratelimit.vote_throttled(request.user.id, question_id):
+        ratelimit.release_vote(request.user.id, question_id)
+        logger.warning(
+            f'User {request.user.username} is voting too fast '
+            f'on question {question_id}.')
+        return HttpResponse(
+            "Too many votes. Please wait a moment and try again.",
+            status=429)
+
     question = get_object_or_404(Question, pk=question_id)
 
     if not question.can_vote():
+        ratelimit.release_vote(request.user.id, question_id)
         messages.error(request, "This question is not published yet.")
         logger.warning(
             f'User {request.user.username} attempted to vote on'
@@ -140,6 +261,7 @@ def vote(request, question_id):
     try:
         selected_choice = question.choice_set.get(pk=request.POST["choice"])
     except (KeyError, Choice.DoesNotExist):
+        ratelimit.release_vote(request.user.id, question_id)
         logger.error(
             f'User {request.user.username} attempted '
             f'to vote with invalid choice on question {question_id}.')
@@ -155,30 +277,142 @@ def vote(request, question_id):
     # Reference to the current user
     this_user = request.user
 
-    # Get the user's vote
-    try:
-        # vote = this_user.vote_set.get(choice__question=question)
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        # user has a vote for this question! update his choice.
-        vote.choice = selected_choice
-        vote.save()
+    previous_choice_id = save_vote(this_user, question, selected_choice)
+    if previous_choice_id is None:
+        events.record(events.VOTE_CAST, username=this_user.username,
+                      question_id=question.id, choice_id=selected_choice.id)
+        metrics.VOTES.inc(kind="created")
+        messages.success(request, "Your vote has been recorded.")
+        logger.info(
+            f'User {this_user.username} voted for '
+            f'choice {selected_choice.id} on question {question_id}.')
+    else:
+        events.record(events.VOTE_CHANGED, username=this_user.username,
+                      question_id=question.id, choice_id=selected_choice.id,
+                      previous_choice_id=previous_choice_id)
+        metrics.VOTES.inc(kind="updated")
         messages.success(request, "Your vote has been updated.")
         logger.info(
             f'User {this_user.username} updated vote '
             f'to choice {selected_choice.id} for question {question_id}.')
-    except Vote.DoesNotExist:
-        # does not have a vote yet, create a new one
-        vote = Vote.objects.create(user=this_user, choice=selected_choice)
-        vote.save()
-        # automatically saved
+
+    # read the results from the primary so they include this vote
+    return routers.pin_to_primary(HttpResponseRedirect(
+        reverse("polls:results", args=(question.id,))
+    ))
+
+
+def save_vote(user, question, choice):
+    """Store the user's vote for `choice` and update the totals.
+
+    The user's vote is locked, so that concurrent changes of it are
+    applied to the totals one after the other. A first vote that loses a
+    race with another first vote of the user hits the unique constraint
+    and is applied as a change of that vote.
+
+    Args:
+        user (User): The voter.
+        question (Question): The question voted on.
+        choice (Choice): The selected choice.
+
+    Returns:
+        int: The id of the previously selected choice, or None for a
+             first vote.
+    """
+    with transaction.atomic():
+        vote = Vote.objects.select_for_update().filter(
+            user=user, question=question).first()
+        if vote is None:
+            # does not have a vote yet, create a new one
+            try:
+                with transaction.atomic():
+                    Vote.objects.create(user=user, question=question,
+                                        choice=choice)
+            except IntegrityError:
+                vote = Vote.objects.select_for_update().get(
+                    user=user, question=question)
+        previous_choice_id = vote.choice_id if vote is not None else None
+        if vote is not None:
+            # user has a vote for this question! update his choice.
+            vote.choice = choice
+            vote.save()
+        results.record_vote(question, choice, previous_choice_id)
+    return previous_choice_id
+
+
+def guest_vote(request, question_id):
+    """Record a vote from a visitor without an account.
+
+    Only questions with `allow_guests` accept guest votes, once per
+    device; for the others the visitor is sent to the login page. The
+    device must send the token it got when it opened the poll, otherwise
+    a client that drops cookies could vote again with every request, so
+    it is sent back to the poll. Guests are also limited per IP, since
+    tokens cost nothing to get.
+    """
+    question = Question.objects.filter(pk=question_id,
+                                       allow_guests=True).first()
+    if question is None:
+        return redirect_to_login(request.get_full_path())
+    token = guests.get_device_token(request)
+    if token is None:
+        messages.error(request, "Please enable cookies to vote as a guest.")
+        return HttpResponseRedirect(
+            reverse("polls:detail", args=(question.id,)))
+    key = guests.token_hash(token)
+    voter = f"guest:{key}"
+    choice_id = request.POST.get("choice")
+    if ratelimit.claim_vote(voter, question.id, choice_id):
+        metrics.VOTES.inc(kind="coalesced")
+        return HttpResponseRedirect(
+            reverse("polls:results", args=(question.id,)))
+    ip = ratelimit.client_ip(request)
+    if ratelimit.vote_throttled(voter, question.id) or \
+            ratelimit.guest_ip_throttled(ip, question.id):
+        ratelimit.release_vote(voter, question.id)
+        logger.warning(
+            f'A guest is voting too fast on question {question.id}.')
+        return HttpResponse(
+            "Too many votes. Please wait a moment and try again.",
+            status=429)
+
+    if not question.can_vote():
+        ratelimit.release_vote(voter, question.id)
+        messages.error(request, "This question is not published yet.")
+        return HttpResponseRedirect(reverse("polls:index"))
+
+    try:
+        selected_choice = question.choice_set.get(pk=choice_id)
+    except (ValueError, Choice.DoesNotExist):
+        ratelimit.release_vote(voter, question.id)
+        return render(
+            request,
+            "polls/detail.html",
+            {
+                "question": question,
+                "error_message": "You didn't select a choice.",
+            }
+        )
+
+    previous_choice_id = guests.record_guest_vote(
+        question, selected_choice, key)
+    if previous_choice_id is None:
+        events.record(events.VOTE_CAST, question_id=question.id,
+                      choice_id=selected_choice.id, guest=True)
+        metrics.VOTES.inc(kind="guest_created")
         messages.success(request, "Your vote has been recorded.")
-        logger.info(
-            f'User {this_user.username} voted for '
-            f'choice {selected_choice.id} on question {question_id}.')
+    else:
+        events.record(events.VOTE_CHANGED, question_id=question.id,
+                      choice_id=selected_choice.id,
+                      previous_choice_id=previous_choice_id, guest=True)
+        metrics.VOTES.inc(kind="guest_updated")
+        messages.success(request, "Your vote has been updated.")
+    logger.info(f'A guest voted for choice {selected_choice.id} '
+                f'on question {question.id}.')
 
-    return HttpResponseRedirect(
+    return routers.pin_to_primary(HttpResponseRedirect(
         reverse("polls:results", args=(question.id,))
-    )
+    ))
 
 
 def signup(request):